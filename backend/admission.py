@@ -0,0 +1,222 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Hashable, Optional
+from fastapi import HTTPException, status
+from ttl_cache import TTLCache
+
+# Model-backed requests running at once across the process
+MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+# Requests allowed to wait for a slot; beyond this new ones are turned away
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "128"))
+# Longest a request may wait for a slot, in seconds
+MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+# Per-user token bucket: sustained requests per minute and burst size
+USER_RATE_PER_MINUTE = float(os.getenv("ADMISSION_USER_RATE", "20"))
+USER_BURST = int(os.getenv("ADMISSION_USER_BURST", "5"))
+
+# Recent waits and service times kept for percentiles and wait estimates
+SAMPLE_SIZE = 1000
+
+class TokenBucket:
+    """Allows `burst` requests at once, refilling at `rate` per second"""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, otherwise the seconds until one is available"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+class Ticket:
+    """A granted slot; release it exactly once when the work ends (extra calls are ignored)"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = controller.clock()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self._controller.clock() - self._started)
+
+class AdmissionController:
+    """
+    Admission control in front of the model: a per-user token bucket, a global
+    concurrency limit and a bounded FIFO wait queue. Requests that can't start
+    within max_wait are shed up front (503) instead of timing out downstream
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT,
+        max_queue: int = MAX_QUEUE,
+        max_wait: float = MAX_WAIT,
+        user_rate_per_minute: float = USER_RATE_PER_MINUTE,
+        user_burst: int = USER_BURST,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.user_rate = user_rate_per_minute / 60.0
+        self.user_burst = user_burst
+        self.clock = clock
+        # Idle users' buckets are full again after burst / rate seconds, so they can expire then
+        refill_time = user_burst / self.user_rate if self.user_rate > 0 else None
+        self._buckets = TTLCache(maxsize=100000, ttl=refill_time)
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._waits: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self._service_times: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self.peak_queue_depth = 0
+        self.counts: Dict[str, int] = {
+            "admitted": 0,
+            "rate_limited": 0,
+            "queue_full": 0,
+            "shed": 0,
+            "timed_out": 0,
+        }
+
+    def _reject(self, reason: str, status_code: int, detail: str, retry_after: float):
+        self.counts[reason] += 1
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def check_rate(self, user_id: Optional[Hashable]):
+        """Charge one request to the user's rate limit, raising 429 when it is used up"""
+        if user_id is None or self.user_rate <= 0:
+            return
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst, self.clock)
+        retry_after = bucket.take()
+        self._buckets.set(user_id, bucket)
+        if retry_after:
+            self._reject(
+                "rate_limited", status.HTTP_429_TOO_MANY_REQUESTS,
+                "Too many requests, please slow down", retry_after
+            )
+
+    def _average_service_time(self) -> float:
+        if not self._service_times:
+            return 0.0
+        return sum(self._service_times) / len(self._service_times)
+
+    def estimated_wait(self, position: Optional[int] = None) -> float:
+        """Expected wait for a request joining the queue at `position` (default: the back)"""
+        position = len(self._waiters) if position is None else position
+        return (position // max(self.max_concurrent, 1) + 1) * self._average_service_time()
+
+    async def acquire(self, user_id: Optional[Hashable] = None) -> Ticket:
+        """Wait for a slot, or raise HTTPException 429/503 with Retry-After"""
+        self.check_rate(user_id)
+
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self._waits.append(0.0)
+            self.counts["admitted"] += 1
+            return Ticket(self)
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject(
+                "queue_full", status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Server is busy, please retry", self.estimated_wait()
+            )
+        # Don't queue requests that would time out anyway
+        estimate = self.estimated_wait()
+        if estimate > self.max_wait:
+            self._reject(
+                "shed", status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Server is busy, please retry", estimate
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.peak_queue_depth = max(self.peak_queue_depth, len(self._waiters))
+        started = self.clock()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self._release_slot()
+            else:
+                waiter.cancel()
+                self._remove_waiter(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(
+                "timed_out", status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Server is busy, please retry", self.estimated_wait()
+            )
+        self._waits.append(self.clock() - started)
+        self.counts["admitted"] += 1
+        return Ticket(self)
+
+    @asynccontextmanager
+    async def admit(self, user_id: Optional[Hashable] = None):
+        """Hold a slot for the duration of the block"""
+        ticket = await self.acquire(user_id)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _remove_waiter(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self, service_time: float):
+        self._service_times.append(service_time)
+        self._release_slot()
+
+    def _release_slot(self):
+        # Hand the slot straight to the oldest live waiter, so it can't be taken by a newcomer
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> dict:
+        """Slots in use, queue depth, wait percentiles and rejection counts"""
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": len(self._waiters),
+            "peak_queue_depth": self.peak_queue_depth,
+            "max_queue": self.max_queue,
+            "wait_p50_ms": round(percentile(0.5) * 1000, 1),
+            "wait_p95_ms": round(percentile(0.95) * 1000, 1),
+            "avg_service_ms": round(self._average_service_time() * 1000, 1),
+            **self.counts,
+        }
+
+# Shared by every endpoint that calls the model
+controller = AdmissionController()
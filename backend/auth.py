@@ -3,10 +3,17 @@ from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+import asyncio
 import hashlib
+import hmac
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
-from database import get_db
+from database import AsyncDB, get_async_db
+from ttl_cache import TTLCache
+import metrics
 import models
 
 # to get a string like this run:
@@ -17,38 +24,112 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def get_password_hash(password: str) -> str:
+# Decoded token subjects, each kept until its token expires
+_token_cache = TTLCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+# Authenticated users by username; the short TTL bounds staleness across workers
+_principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+)
+
+# Password hashing cost; existing hashes are upgraded on the next successful login
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "100000"))
+HASH_SCHEME = "pbkdf2_sha256"
+# Hashes stored as "salt:key" before the versioned format used this many iterations
+LEGACY_ITERATIONS = 100000
+
+# Dedicated pool for password hashing; pbkdf2_hmac releases the GIL, so threads run in parallel
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hashing jobs allowed to wait for a worker before new logins are turned away
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "256"))
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_lock = threading.Lock()
+_hash_in_flight = 0
+_hash_peak_queue_depth = 0
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+def get_password_hash(password: str, iterations: Optional[int] = None) -> str:
+    iterations = iterations or PBKDF2_ITERATIONS
     # Generate a random salt
     salt = os.urandom(32)
     # Hash password with salt
-    key = hashlib.pbkdf2_hmac(
-        'sha256',
-        password.encode('utf-8'),
-        salt,
-        100000  # Number of iterations
-    )
-    # Store salt and key together
-    return salt.hex() + ':' + key.hex()
+    key = _pbkdf2(password, salt, iterations)
+    # Store scheme, cost, salt and key together
+    return f"{HASH_SCHEME}${iterations}${salt.hex()}${key.hex()}"
+
+def _parse_hash(stored_password: str):
+    """Split a stored hash into (iterations, salt, key)"""
+    if stored_password.startswith(HASH_SCHEME + "$"):
+        _, iterations, salt_str, key_str = stored_password.split('$')
+        return int(iterations), bytes.fromhex(salt_str), bytes.fromhex(key_str)
+    # Legacy "salt:key" format
+    salt_str, key_str = stored_password.split(':')
+    return LEGACY_ITERATIONS, bytes.fromhex(salt_str), bytes.fromhex(key_str)
 
 def verify_password(plain_password: str, stored_password: str) -> bool:
     try:
-        # Split stored password into salt and key
-        salt_str, key_str = stored_password.split(':')
-        # Convert hex strings back to bytes
-        salt = bytes.fromhex(salt_str)
-        stored_key = bytes.fromhex(key_str)
-        # Hash the provided password with the same salt
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            plain_password.encode('utf-8'),
-            salt,
-            100000  # Same number of iterations
-        )
+        iterations, salt, stored_key = _parse_hash(stored_password)
+        # Hash the provided password with the same salt and cost
+        key = _pbkdf2(plain_password, salt, iterations)
         # Compare the keys
-        return key == stored_key
-    except:
+        return hmac.compare_digest(key, stored_key)
+    except (ValueError, TypeError, AttributeError):
         return False
 
+def needs_rehash(stored_password: str) -> bool:
+    """Whether a stored hash uses the legacy format or a different iteration count"""
+    try:
+        iterations, _, _ = _parse_hash(stored_password)
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return not stored_password.startswith(HASH_SCHEME + "$") or iterations != PBKDF2_ITERATIONS
+
+def _timed_hash_job(operation: str, func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        metrics.password_hash_seconds.observe(time.perf_counter() - start, operation=operation)
+
+async def _run_hash_job(operation: str, func, *args):
+    global _hash_in_flight, _hash_peak_queue_depth
+    with _hash_lock:
+        if _hash_in_flight - HASH_WORKERS >= HASH_QUEUE_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts in progress, please retry",
+                headers={"Retry-After": "1"},
+            )
+        _hash_in_flight += 1
+        _hash_peak_queue_depth = max(_hash_peak_queue_depth, _hash_in_flight - HASH_WORKERS)
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, _timed_hash_job, operation, func, *args)
+    finally:
+        with _hash_lock:
+            _hash_in_flight -= 1
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password on the hashing pool instead of the event loop"""
+    return await _run_hash_job("hash", get_password_hash, password)
+
+async def verify_password_async(plain_password: str, stored_password: str) -> bool:
+    """Verify a password on the hashing pool instead of the event loop"""
+    return await _run_hash_job("verify", verify_password, plain_password, stored_password)
+
+def hashing_stats() -> dict:
+    """Hashing pool size, jobs in flight and how many are queued behind the workers"""
+    with _hash_lock:
+        return {
+            "workers": HASH_WORKERS,
+            "in_flight": _hash_in_flight,
+            "queue_depth": max(0, _hash_in_flight - HASH_WORKERS),
+            "peak_queue_depth": _hash_peak_queue_depth,
+            "queue_limit": HASH_QUEUE_LIMIT,
+        }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -59,21 +140,47 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def _principal(user: models.User) -> models.User:
+    """Detached copy of a user that is safe to share between requests and sessions"""
+    return models.User(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        hashed_password=user.hashed_password
+    )
+
+def get_user(db: Session, username: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.username == username).first()
+
+def invalidate_user(username: str):
+    """Drop a cached principal; call whenever a user row changes"""
+    _principal_cache.pop(username)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncDB = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = _token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.username == username).first()
+        # Keep the decoded subject until the token expires
+        expires_in = payload.get("exp", 0) - time.time()
+        if expires_in > 0:
+            _token_cache.set(token, username, ttl=expires_in)
+
+    user = _principal_cache.get(username)
     if user is None:
-        raise credentials_exception
-    return user 
\ No newline at end of file
+        db_user = await db.run(get_user, username)
+        if db_user is None:
+            raise credentials_exception
+        user = _principal(db_user)
+        _principal_cache.set(username, user)
+    return user
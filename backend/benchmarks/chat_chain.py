@@ -0,0 +1,76 @@
+"""
+Offline throughput benchmark for the chat agent chain
+
+Runs get_chat_response against the local stub provider, so the numbers show
+the pipeline's own overhead on top of the configured model latency.
+
+    python -m benchmarks.chat_chain --requests 200 --concurrency 20 --latency-ms 100
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "stub")
+
+import llm
+import chatbot
+
+async def run(requests: int, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    stage_latencies = {}
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await chatbot.run_chat_pipeline(f"Question {i}: how do fractions work?")
+            except Exception as e:
+                print(f"Request {i} failed: {e}")
+                return
+            latencies.append(time.perf_counter() - start)
+            for stage, seconds in result.timings.items():
+                stage_latencies.setdefault(stage, []).append(seconds)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, stage_latencies
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="0 disables token pacing")
+    parser.add_argument("--response-tokens", type=int, default=60)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    chatbot.set_provider(llm.StubProvider(
+        latency=args.latency_ms / 1000,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        failure_rate=args.failure_rate
+    ))
+
+    start = time.perf_counter()
+    latencies, stage_latencies = asyncio.run(run(args.requests, args.concurrency))
+    elapsed = time.perf_counter() - start
+
+    if not latencies:
+        print("All requests failed")
+        return
+    print(f"Completed {len(latencies)}/{args.requests} requests in {elapsed:.2f}s")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(f"Latency p50: {percentile(latencies, 50) * 1000:.1f} ms, "
+          f"p95: {percentile(latencies, 95) * 1000:.1f} ms, "
+          f"p99: {percentile(latencies, 99) * 1000:.1f} ms")
+    for stage, values in stage_latencies.items():
+        print(f"  {stage:<10} p50: {percentile(values, 50) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
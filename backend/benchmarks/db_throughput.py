@@ -0,0 +1,102 @@
+"""
+Database throughput benchmark
+
+Drives the app in-process with concurrent chat and learning profile requests
+against a scratch SQLite database, using the stub LLM so the database is the
+bottleneck, and reports requests/sec. Compare the two database paths with:
+
+    DB_ASYNC=1 python -m benchmarks.db_throughput --requests 2000 --concurrency 64
+    DB_ASYNC=0 python -m benchmarks.db_throughput --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+BENCHMARK_DB = "benchmark.db"
+os.environ["DATABASE_URL"] = f"sqlite:///./{BENCHMARK_DB}"
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("STUB_LATENCY_MS", "5")
+os.environ.setdefault("STUB_TOKENS_PER_SECOND", "0")
+# Admission control would otherwise rate-limit the few benchmark users and shed the
+# load, measuring 429/503 responses instead of the database
+os.environ.setdefault("ADMISSION_USER_RATE", "0")
+os.environ.setdefault("ADMISSION_MAX_CONCURRENT", "1024")
+os.environ.setdefault("ADMISSION_MAX_QUEUE", "100000")
+
+import httpx
+import database
+import main as app_main
+
+PROFILE = {"verbal_score": 7, "non_verbal_score": 5, "self_assessment": 3, "age": 12}
+
+async def setup(client: httpx.AsyncClient, users: int):
+    """Create users with profiles and one chat session each, returning (headers, session_id) pairs"""
+    accounts = []
+    for i in range(users):
+        username = f"bench{i}"
+        await client.post("/signup", json={"username": username, "email": f"{username}@example.com", "password": "pw"})
+        token = (await client.post("/login", data={"username": username, "password": "pw"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.post("/assessment/profile", json=PROFILE, headers=headers)
+        session_id = (await client.post("/api/chat/sessions", headers=headers)).json()["id"]
+        accounts.append((headers, session_id))
+    return accounts
+
+async def run(requests: int, concurrency: int, users: int, chat_share: float):
+    transport = httpx.ASGITransport(app=app_main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        accounts = await setup(client, users)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = {"chat": [], "profile": []}
+        errors = 0
+
+        async def one(i: int):
+            nonlocal errors
+            headers, session_id = accounts[i % len(accounts)]
+            kind = "chat" if (i % 100) < chat_share * 100 else "profile"
+            async with semaphore:
+                start = time.perf_counter()
+                if kind == "chat":
+                    response = await client.post(
+                        "/chat",
+                        data={"message": f"Question {i} about fractions", "session_id": session_id},
+                        headers=headers
+                    )
+                else:
+                    response = await client.get("/assessment/profile", headers=headers)
+                latencies[kind].append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    print(f"Database path: {'async (aiosqlite)' if database.DB_ASYNC else 'sync engine in threadpool'}, "
+          f"pool size: {database.DB_POOL_SIZE}")
+    print(f"{requests} requests, concurrency {concurrency}, {errors} errors, {elapsed:.2f}s")
+    print(f"Throughput: {requests / elapsed:.1f} requests/s")
+    for kind, values in latencies.items():
+        if values:
+            values.sort()
+            print(f"  {kind:<8} n={len(values):<6} p50={statistics.median(values) * 1000:7.1f} ms  "
+                  f"p95={values[int(len(values) * 0.95)] * 1000:7.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--chat-share", type=float, default=0.5, help="fraction of requests that are chat messages")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.requests, args.concurrency, args.users, args.chat_share))
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(BENCHMARK_DB + suffix):
+                os.remove(BENCHMARK_DB + suffix)
+
+if __name__ == "__main__":
+    main()
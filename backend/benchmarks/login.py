@@ -0,0 +1,54 @@
+"""
+Login throughput benchmark
+
+Verifies passwords through the auth hashing pool the way /login does and
+reports logins/sec overall and per core.
+
+    python -m benchmarks.login --logins 400 --concurrency 64 --iterations 100000
+"""
+import argparse
+import asyncio
+import os
+import time
+import auth
+
+async def run(stored_hash: str, logins: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    peak_queue_depth = 0
+
+    async def one():
+        nonlocal peak_queue_depth
+        async with semaphore:
+            assert await auth.verify_password_async("correct horse", stored_hash)
+            peak_queue_depth = max(peak_queue_depth, auth.hashing_stats()["queue_depth"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    print(f"Peak hashing queue depth: {peak_queue_depth}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--iterations", type=int, default=auth.PBKDF2_ITERATIONS)
+    args = parser.parse_args()
+
+    stored_hash = auth.get_password_hash("correct horse", iterations=args.iterations)
+
+    # Single-threaded baseline: one verification at a time
+    start = time.perf_counter()
+    for _ in range(10):
+        auth.verify_password("correct horse", stored_hash)
+    single = (time.perf_counter() - start) / 10
+
+    elapsed = asyncio.run(run(stored_hash, args.logins, args.concurrency))
+    cores = os.cpu_count() or 1
+    rate = args.logins / elapsed
+    print(f"PBKDF2 iterations: {args.iterations}, hashing workers: {auth.HASH_WORKERS}, cores: {cores}")
+    print(f"Single verification: {single * 1000:.1f} ms")
+    print(f"Throughput: {rate:.1f} logins/s ({rate / cores:.1f} logins/s per core)")
+
+if __name__ == "__main__":
+    main()
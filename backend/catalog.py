@@ -0,0 +1,181 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Relative weight of a match in each searchable field
+FIELD_WEIGHTS = {"name": 3.0, "subcategory": 2.0, "category": 1.5, "description": 1.0}
+
+# Score multiplier for a query token that only matches as a prefix (typeahead)
+PREFIX_MATCH_WEIGHT = 0.5
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN.findall((text or "").lower())
+
+class SearchIndex:
+    """Inverted index over subject fields with prefix matching for typeahead"""
+
+    def __init__(self, subjects: List[dict]):
+        self.subjects = subjects
+        # token -> {subject position: best field weight}
+        self.postings: Dict[str, Dict[int, float]] = {}
+        for position, subject in enumerate(subjects):
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(subject.get(field)):
+                    documents = self.postings.setdefault(token, {})
+                    documents[position] = max(documents.get(position, 0.0), weight)
+        self.vocabulary = sorted(self.postings)
+
+    def _terms(self, token: str) -> List[str]:
+        """Indexed tokens that start with the query token"""
+        start = bisect.bisect_left(self.vocabulary, token)
+        end = bisect.bisect_left(self.vocabulary, token + "\uffff")
+        return self.vocabulary[start:end]
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[int, List[dict]]:
+        """Subjects matching every query token, best first; returns (total, page)"""
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+
+        scores: Optional[Dict[int, float]] = None
+        for token in tokens:
+            token_scores: Dict[int, float] = {}
+            for term in self._terms(token):
+                factor = 1.0 if term == token else PREFIX_MATCH_WEIGHT
+                for position, weight in self.postings[term].items():
+                    token_scores[position] = max(token_scores.get(position, 0.0), weight * factor)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {p: s + token_scores[p] for p, s in scores.items() if p in token_scores}
+            if not scores:
+                return 0, []
+
+        # Typeahead: names that start with what was typed come first
+        typed = " ".join(tokens)
+        for position in scores:
+            if " ".join(tokenize(self.subjects[position]["name"])).startswith(typed):
+                scores[position] += FIELD_WEIGHTS["name"]
+
+        ranked = sorted(scores, key=lambda p: (-scores[p], self.subjects[p]["name"]))
+        return len(ranked), [self.subjects[p] for p in ranked[offset:offset + limit]]
+
+class SubjectCatalog:
+    """
+    In-memory subject catalog loaded once from subjects.json
+    Keeps precomputed category -> subcategory -> subject indexes and reloads
+    them when the file's mtime changes
+    """
+
+    def __init__(
+        self,
+        path: str = "subjects.json",
+        check_interval: float = 1.0,
+        extra_subjects: Optional[Callable[[], List[dict]]] = None
+    ):
+        self.path = path
+        # Optional source of additional searchable subjects (e.g. the subjects table)
+        self.extra_subjects = extra_subjects
+        # Minimum seconds between mtime checks, so hot endpoints don't stat on every request
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.subjects: List[dict] = []
+        self.by_id: Dict[int, dict] = {}
+        self.categories: List[str] = []
+        self.subcategories: Dict[str, List[str]] = {}
+        self.by_subcategory: Dict[str, List[dict]] = {}
+        self.etag = None
+        self._search_index: Optional[SearchIndex] = None
+        self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        mtime = os.path.getmtime(self.path)
+        subjects = json.loads(raw).get('subjects', [])
+
+        by_id = {}
+        subcategories: Dict[str, set] = {}
+        by_subcategory: Dict[str, List[dict]] = {}
+        for subject in subjects:
+            by_id[subject['id']] = subject
+            subcategories.setdefault(subject['category'], set()).add(subject['subcategory'])
+            by_subcategory.setdefault(subject['subcategory'], []).append(subject)
+
+        # Swap in the new indexes together so readers never see a partial load
+        (self.subjects, self.by_id, self.categories, self.subcategories, self.by_subcategory,
+         self.etag, self._mtime) = (
+            subjects,
+            by_id,
+            sorted(subcategories),
+            {category: sorted(names) for category, names in subcategories.items()},
+            by_subcategory,
+            '"' + hashlib.sha256(raw).hexdigest()[:32] + '"',
+            mtime,
+        )
+        self._search_index = None
+
+    def refresh(self) -> bool:
+        """Reload if the file changed since the last load; returns True if it reloaded"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+            try:
+                if os.path.getmtime(self.path) == self._mtime:
+                    return False
+                self._load()
+            except (OSError, ValueError) as e:
+                # Keep serving the last good catalog if the file is mid-write or invalid
+                print(f"Warning: Failed to reload {self.path}: {e}")
+                return False
+            return True
+
+    def get_categories(self) -> List[str]:
+        self.refresh()
+        return self.categories
+
+    def get_subcategories(self, category: str) -> Optional[List[str]]:
+        self.refresh()
+        return self.subcategories.get(category)
+
+    def all_subcategories(self) -> List[str]:
+        """Every subcategory in the catalog, sorted"""
+        self.refresh()
+        return sorted(self.by_subcategory)
+
+    def has_subcategory(self, subcategory: str) -> bool:
+        self.refresh()
+        return subcategory in self.by_subcategory
+
+    def invalidate_search(self):
+        """Rebuild the search index on next use (call after changing extra subjects)"""
+        self._search_index = None
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[int, List[dict]]:
+        """Ranked full-text/prefix search over name, category, subcategory and description"""
+        self.refresh()
+        index = self._search_index
+        if index is None:
+            subjects = list(self.subjects)
+            if self.extra_subjects:
+                seen = {(s['name'].lower(), s['category'], s['subcategory']) for s in subjects}
+                for subject in self.extra_subjects():
+                    key = (subject['name'].lower(), subject['category'], subject['subcategory'])
+                    if key not in seen:
+                        seen.add(key)
+                        subjects.append(subject)
+            index = self._search_index = SearchIndex(subjects)
+        return index.search(query, limit, offset)
@@ -0,0 +1,171 @@
+import base64
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import inspect, or_, and_, text
+from sqlalchemy.orm import Session
+import models
+
+# Columns added after the tables were first created; ensure_schema adds them to older databases
+ADDED_COLUMNS = {
+    "chat_messages": {"session_id": "VARCHAR REFERENCES chat_sessions(id)"},
+    "chat_sessions": {"summary": "TEXT", "summarized_through_id": "INTEGER DEFAULT 0"},
+}
+
+def ensure_schema(engine):
+    """Bring chat tables created by older versions up to date"""
+    inspector = inspect(engine)
+    for table, added in ADDED_COLUMNS.items():
+        columns = {column["name"] for column in inspector.get_columns(table)}
+        with engine.begin() as connection:
+            for name, definition in added.items():
+                if name not in columns:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+    for index in models.ChatMessage.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+def _encode_cursor(*parts) -> str:
+    return base64.urlsafe_b64encode("|".join(str(p) for p in parts).encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str, count: int) -> List[str]:
+    try:
+        parts = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if len(parts) != count:
+        raise ValueError("Invalid cursor")
+    return parts
+
+def create_session(db: Session, user_id: int, title: str = "New Chat") -> models.ChatSession:
+    now = datetime.utcnow()
+    session = models.ChatSession(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        title=title,
+        created_at=now,
+        updated_at=now
+    )
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return session
+
+def get_session(db: Session, user_id: int, session_id: str) -> Optional[models.ChatSession]:
+    """A session, only if it belongs to the user"""
+    return db.query(models.ChatSession).filter(
+        models.ChatSession.id == session_id,
+        models.ChatSession.user_id == user_id
+    ).first()
+
+def append_message(
+    db: Session,
+    user_id: int,
+    session_id: Optional[str],
+    content: str,
+    response: str,
+    planning_analysis: str = "",
+    final_analysis: str = ""
+) -> models.ChatMessage:
+    """Insert one exchange and bump the session's updated_at; nothing else is rewritten"""
+    now = datetime.utcnow()
+    message = models.ChatMessage(
+        user_id=user_id,
+        session_id=session_id,
+        content=content,
+        response=response,
+        planning_analysis=planning_analysis,
+        final_analysis=final_analysis,
+        created_at=now
+    )
+    db.add(message)
+    if session_id:
+        db.query(models.ChatSession).filter(models.ChatSession.id == session_id).update(
+            {models.ChatSession.updated_at: now}, synchronize_session=False
+        )
+    db.commit()
+    db.refresh(message)
+    return message
+
+def list_sessions(
+    db: Session,
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = 20
+) -> Tuple[List[models.ChatSession], Optional[str]]:
+    """A page of the user's sessions, most recently active first, and the next cursor"""
+    query = db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id)
+    if cursor:
+        updated_at, session_id = _decode_cursor(cursor, 2)
+        updated_at = datetime.fromisoformat(updated_at)
+        query = query.filter(or_(
+            models.ChatSession.updated_at < updated_at,
+            and_(models.ChatSession.updated_at == updated_at, models.ChatSession.id < session_id)
+        ))
+    sessions = query.order_by(
+        models.ChatSession.updated_at.desc(), models.ChatSession.id.desc()
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        next_cursor = _encode_cursor(last.updated_at.isoformat(), last.id)
+    return sessions, next_cursor
+
+def list_messages(
+    db: Session,
+    session_id: str,
+    cursor: Optional[str] = None,
+    limit: int = 50
+) -> Tuple[List[models.ChatMessage], Optional[str]]:
+    """The newest page of a session's messages (oldest first) and a cursor to older ones"""
+    query = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session_id)
+    if cursor:
+        before_id = _decode_cursor(cursor, 1)[0]
+        if not before_id.isdigit():
+            raise ValueError("Invalid cursor")
+        query = query.filter(models.ChatMessage.id < int(before_id))
+    messages = query.order_by(models.ChatMessage.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = _encode_cursor(messages[-1].id)
+    messages.reverse()
+    return messages, next_cursor
+
+def delete_session(db: Session, user_id: int, session_id: str) -> bool:
+    """Delete a session and its messages; False if the user has no such session"""
+    session = get_session(db, user_id, session_id)
+    if session is None:
+        return False
+    db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session_id).delete(
+        synchronize_session=False
+    )
+    db.delete(session)
+    db.commit()
+    return True
+
+def list_unsummarized_messages(
+    db: Session,
+    session_id: str,
+    after_id: int,
+    before_id: int,
+    limit: int
+) -> List[models.ChatMessage]:
+    """Messages between after_id and before_id (exclusive), oldest first"""
+    return db.query(models.ChatMessage).filter(
+        models.ChatMessage.session_id == session_id,
+        models.ChatMessage.id > after_id,
+        models.ChatMessage.id < before_id
+    ).order_by(models.ChatMessage.id.asc()).limit(limit).all()
+
+def save_summary(db: Session, session_id: str, summary: str, summarized_through_id: int):
+    db.query(models.ChatSession).filter(models.ChatSession.id == session_id).update(
+        {
+            models.ChatSession.summary: summary,
+            models.ChatSession.summarized_through_id: summarized_through_id,
+        },
+        synchronize_session=False
+    )
+    db.commit()
@@ -1,22 +1,60 @@
 import os
 import json
-import base64
-import google.generativeai as genai
+import asyncio
+import time
 from dotenv import load_dotenv
-from PIL import Image
-from io import BytesIO
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import AsyncIterator, List, Optional, Dict, Set
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
+import chat_store
+import llm
+import metrics
+import query_router
+from conversation import ConversationContext, STAGE_TOKEN_BUDGETS
+import schemas
+from pipeline import Pipeline, PipelineResult, Stage
+from resilience import ModelCaller
+from response_cache import ResponseCache, StageCache, normalize_query
+from image_pipeline import PreparedImage, prepare_image
+from ttl_cache import TTLCache
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# Initialize the model provider (Gemini, or the local stub for load testing)
+provider = llm.get_provider()
 
-# Initialize the model
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Deadlines, retries, circuit breaker and hedging for every model call
+model_calls = ModelCaller()
+
+def set_provider(new_provider: llm.LLMProvider):
+    """Swap the model provider used by the chatbot"""
+    global provider
+    provider = new_provider
+    model_calls.breaker.reset()
+
+# Cache of final responses for repeated queries (size 0 disables it)
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+    similarity=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.85"))
+)
+
+# Cache of planning/analysis outputs, shared across profiles
+stage_cache = StageCache(
+    maxsize=int(os.getenv("STAGE_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("STAGE_CACHE_TTL", "86400"))
+)
+
+# Vision analyses by image content hash and query, so re-sent images skip the model call
+vision_cache = TTLCache(
+    maxsize=int(os.getenv("VISION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("VISION_CACHE_TTL", "86400"))
+)
+
+# Pipeline stages reported to streaming clients
+AGENT_STAGES = ("vision", "planning", "analysis", "final")
 
 class Message(BaseModel):
     content: str
@@ -52,7 +90,7 @@ GUIDELINES:
 * Focus on constructive guidance rather than just pointing out errors.
 * If new information emerges from the user, be ready to refine the roadmap.
 * Maintain a supportive and instructional tone.
-
+{conversation}
 USER QUERY: {user_query}
 """
 
@@ -83,128 +121,442 @@ GUIDELINES:
 Always add Additional Related Question in the end of the report:
 
 PLANNING AGENT OUTPUT: {planning_output}
+{conversation}
 USER QUERY: {user_query}
 """
 
 
-async def process_image(image_data: bytes) -> str:
-    """Process the uploaded image data into a base64 string"""
-    try:
-        # Convert bytes to PIL Image
-        image = Image.open(BytesIO(image_data))
-        
-        # Ensure the image is in RGB mode
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        # Convert image to base64
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return img_str
-    except Exception as e:
-        raise ValueError(f"Failed to process image: {str(e)}")
+async def get_vision_response(image: PreparedImage, query: str) -> str:
+    """Get the vision model's analysis of an image, reusing a cached one for the same image and query"""
+    key = (image.digest, normalize_query(query))
+    cached = vision_cache.get(key)
+    if cached is not None:
+        return cached
+    # The image goes to the model as raw bytes alongside the query
+    image_part = {
+        "mime_type": image.mime_type,
+        "data": image.data
+    }
+    output = await model_calls.generate(provider, [image_part, query], "vision")
+    if output:
+        vision_cache.set(key, output)
+    return output
 
-async def get_vision_response(image_base64: str, query: str) -> str:
-    """Get response from Gemini for image analysis"""
-    try:
-        # Decode base64 string back to bytes
-        image_bytes = base64.b64decode(image_base64)
-        
-        # Create a Part object for the image
-        image_part = {
-            "mime_type": "image/jpeg",
-            "data": image_bytes
-        }
-        
-        # Create the prompt parts combining image and text
-        prompt_parts = [
-            image_part,
-            query
-        ]
-        
-        # Use generate_content with both image and text
-        response = await model.generate_content_async(prompt_parts)
-        return response.text
-    except Exception as e:
-        raise Exception(f"Failed to get vision response: {str(e)}")
+async def generate_stage(
+    stage: str,
+    prompt: str,
+    cache_hits: Optional[Set[str]] = None,
+    refresh: bool = False
+) -> str:
+    """
+    Generate a profile-independent agent output, reusing a cached one for the same prompt
+    The stage is added to cache_hits when the cached output is used
+    With refresh, the model is always called and its output replaces the cached one
+    """
+    cached = None if refresh else stage_cache.get(stage, prompt)
+    if cached is not None:
+        if cache_hits is not None:
+            cache_hits.add(stage)
+        return cached
+    output = await model_calls.generate(provider, prompt, stage)
+    if output:
+        stage_cache.set(stage, prompt, output)
+    return output
+
+async def summarize(prompt: str) -> str:
+    """Generate a conversation summary through the resilient call layer"""
+    return await model_calls.generate(provider, prompt, "summary")
+
+def invalidate_stage_cache(stage: Optional[str] = None):
+    """Call after changing PLANNING_AGENT_PROMPT or ANALYSIS_AGENT_PROMPT at runtime"""
+    stage_cache.invalidate(stage)
+
+# Response style by which skill is stronger
+RESPONSE_STYLES = {
+    "verbal": """
+        Focus on providing detailed text explanations and story-based examples.
+        Break down concepts into clear, sequential steps.
+        Use analogies and metaphors to explain complex ideas.
+        Provide written examples and scenarios.
+        """,
+    "non_verbal": """
+        Focus on interactive scaffolding and visual descriptions.
+        Use step-by-step guidance with clear checkpoints.
+        Incorporate spatial and pattern-based explanations.
+        Break complex tasks into smaller, manageable parts.
+        """,
+    "balanced": """
+        Provide a balanced approach with both verbal and visual explanations.
+        Use concise explanations with supporting examples.
+        Combine text-based and pattern-based learning strategies.
+        """,
+}
+
+# Guidance by self-assessed confidence (self-assessment > 7 is high, > 4 moderate)
+CONFIDENCE_GUIDANCE = {
+    "high": """
+        The user's self-assessment indicates high confidence in non-verbal skills.
+        Maintain supportive but direct communication.
+        """,
+    "moderate": """
+        The user's self-assessment indicates moderate confidence in non-verbal skills.
+        Maintain supportive but direct communication.
+        """,
+    "low": """
+        The user's self-assessment indicates low confidence in non-verbal skills.
+        Provide additional encouragement and positive reinforcement.
+        """,
+}
+
+# Age bands as (id, description, exclusive upper bound)
+AGE_BANDS = (
+    ("child", "under 10", 10),
+    ("preteen", "10 to 12", 13),
+    ("teen", "13 to 17", 18),
+    ("adult", "18 or older", None),
+)
+
+DEFAULT_PREAMBLE_ID = "default"
+
+def _compile_preambles() -> Dict[str, str]:
+    preambles = {
+        DEFAULT_PREAMBLE_ID: """
+    User Profile Information:
+    Age: Unknown
+
+    Response Style Guidelines:
+    Provide a balanced approach to explanation.
+    """
+    }
+    for style, response_style in RESPONSE_STYLES.items():
+        for confidence, confidence_guidance in CONFIDENCE_GUIDANCE.items():
+            for band, description, _ in AGE_BANDS:
+                preambles[f"{style}:{confidence}:{band}"] = f"""
+    User Profile Information:
+    Age: {description}
+
+    Response Style Guidelines:
+    {response_style}
+    {confidence_guidance}
+    """
+    return preambles
+
+# Every profile maps to one of these, built once at import instead of per request
+PREAMBLES = _compile_preambles()
+
+def _age_band(age: Optional[int]) -> str:
+    for band, _, upper in AGE_BANDS:
+        if upper is None or (age or 0) < upper:
+            return band
+    return AGE_BANDS[-1][0]
+
+def preamble_id(user_profile: Optional[UserProfile] = None) -> str:
+    """
+    Which precomputed preamble a profile gets: response style, confidence tier and age band
+    Also keys the response cache, so profiles sharing a preamble share cached answers
+    """
+    if not user_profile:
+        return DEFAULT_PREAMBLE_ID
+    if user_profile.verbal_score > user_profile.non_verbal_score:
+        style = "verbal"
+    elif user_profile.non_verbal_score > user_profile.verbal_score:
+        style = "non_verbal"
+    else:
+        style = "balanced"
+    if user_profile.self_assessment > 7:
+        confidence = "high"
+    elif user_profile.self_assessment > 4:
+        confidence = "moderate"
+    else:
+        confidence = "low"
+    return f"{style}:{confidence}:{_age_band(user_profile.age)}"
+
+def build_style_guidance(user_profile: Optional[UserProfile] = None) -> str:
+    """The profile-derived section of the final prompt"""
+    return PREAMBLES[preamble_id(user_profile)]
+
+def conversation_block(conversation: Optional[ConversationContext], stage: str) -> str:
+    """Earlier conversation for a stage prompt, within that stage's token budget"""
+    if not conversation:
+        return ""
+    rendered = conversation.render(STAGE_TOKEN_BUDGETS[stage])
+    return f"\nCONVERSATION SO FAR:\n{rendered}\n" if rendered else ""
+
+def build_final_prompt(
+    user_query: str,
+    final_analysis: str,
+    style_guidance: str,
+    vision_analysis: str = "",
+    conversation: Optional[ConversationContext] = None
+) -> str:
+    """Build the profile-specific prompt for the final response"""
+    return f"""
+    You are a helpful AI assistant for helping students who has a disability called non-verbal learning to understand the concepts, understand ideas and solve the problems. Please provide a clear response to the following query:
+    {style_guidance}{conversation_block(conversation, "final")}
+    User Query: {user_query}
+    {f'Final Analysis: {final_analysis}' if final_analysis else ''}
+    {f'Vision Analysis: {vision_analysis}' if vision_analysis else ''}
+    
+    Please provide a helpful and informative response that matches the user's learning profile and needs.
+    """
+
+def build_chat_pipeline(
+    user_query: str,
+    user_profile: Optional[UserProfile] = None,
+    image_data: bytes = None,
+    include_final: bool = True,
+    conversation: Optional[ConversationContext] = None,
+    route: str = query_router.FULL,
+    cache_hits: Optional[Set[str]] = None,
+    refresh: bool = False
+) -> Pipeline:
+    """
+    Build the agent chain as a DAG:
+    vision -> planning -> analysis -> prompt (-> final), with the profile style built alongside
+    The route decides which agents run: none (direct), planning (light) or both (full)
+    Agents answered from the stage cache are added to cache_hits; refresh bypasses that cache
+    A failed vision, planning or analysis stage is skipped (its output is None) so the
+    chain still answers; only a failed final stage fails the request
+    """
+    async def vision(outputs: dict) -> str:
+        try:
+            image = await prepare_image(image_data)
+            return await get_vision_response(image, user_query)
+        except Exception as e:
+            print(f"Warning: Failed to process image: {str(e)}")
+            return ""
+
+    def combined_query(outputs: dict) -> str:
+        # Combine vision analysis with user query
+        if outputs.get("vision"):
+            return f"{user_query}\n\nImage Analysis: {outputs['vision']}"
+        return user_query
+
+    async def planning(outputs: dict) -> Optional[str]:
+        try:
+            return await generate_stage("planning", PLANNING_AGENT_PROMPT.format(
+                conversation=conversation_block(conversation, "planning"),
+                user_query=combined_query(outputs)
+            ), cache_hits, refresh)
+        except Exception as e:
+            print(f"Warning: Skipping planning stage: {str(e)}")
+            return None
+
+    async def analysis(outputs: dict) -> Optional[str]:
+        try:
+            return await generate_stage("analysis", ANALYSIS_AGENT_PROMPT.format(
+                planning_output=outputs.get("planning") or "Not available",
+                conversation=conversation_block(conversation, "analysis"),
+                user_query=combined_query(outputs)
+            ), cache_hits, refresh)
+        except Exception as e:
+            print(f"Warning: Skipping analysis stage: {str(e)}")
+            return None
+
+    def prompt(outputs: dict) -> str:
+        # Without an analysis, the plan is the best guidance left
+        return build_final_prompt(
+            combined_query(outputs),
+            outputs.get("analysis") or outputs.get("planning") or "",
+            outputs["style"],
+            outputs.get("vision", ""),
+            conversation
+        )
+
+    async def final(outputs: dict) -> str:
+        return await model_calls.generate_hedged(provider, outputs["prompt"], "final")
+
+    agents = query_router.ROUTE_STAGES[route]
+    # The prompt waits on the last agent that runs, or on the vision stage when none do
+    previous = ["vision"] if image_data else []
+    stages = [Stage("style", lambda outputs: build_style_guidance(user_profile))]
+    if "planning" in agents:
+        stages.append(Stage("planning", planning, depends_on=previous))
+        previous = ["planning"]
+    if "analysis" in agents:
+        stages.append(Stage("analysis", analysis, depends_on=previous))
+        previous = ["analysis"]
+    stages.append(Stage("prompt", prompt, depends_on=previous + ["style"]))
+    if image_data:
+        stages.append(Stage("vision", vision))
+    if include_final:
+        stages.append(Stage("final", final, depends_on=["prompt"]))
+    return Pipeline(stages)
+
+def skipped_stages(outputs: Dict[str, Optional[str]]) -> List[str]:
+    """Agent stages that ran but failed; answers built without them are not cached"""
+    return [name for name in ("planning", "analysis") if name in outputs and outputs[name] is None]
+
+async def run_chat_pipeline(
+    user_query: str,
+    user_profile: Optional[UserProfile] = None,
+    image_data: bytes = None,
+    conversation: Optional[ConversationContext] = None,
+    route: str = query_router.FULL,
+    cache_hits: Optional[Set[str]] = None,
+    refresh: bool = False
+) -> PipelineResult:
+    """Run the agent chain for a route (the full chain by default) and return every stage output with its latency"""
+    return await build_chat_pipeline(
+        user_query, user_profile, image_data, conversation=conversation, route=route, cache_hits=cache_hits,
+        refresh=refresh
+    ).run()
+
+def cached_response(
+    user_query: str,
+    user_profile: Optional[UserProfile] = None,
+    image_data: bytes = None,
+    conversation: Optional[ConversationContext] = None
+) -> Optional[str]:
+    """
+    A cached answer to the query, if there is one
+    Cheap enough to check before admission, so cache hits never wait for a model slot
+    """
+    # Image queries and follow-ups are never cached: the answer depends on more than the query
+    if image_data or conversation:
+        return None
+    return response_cache.get(user_query, preamble_id(user_profile))
+
+async def cached_events(response: str) -> AsyncIterator[Dict[str, str]]:
+    """A cached answer as the events stream_chat_response would send"""
+    yield {"event": "stage", "data": "cache"}
+    yield {"event": "token", "data": response}
+    yield {"event": "done", "data": ""}
 
 async def get_chat_response(
     user_query: str,
     user_profile: Optional[UserProfile] = None,
-    image_data: bytes = None
+    image_data: bytes = None,
+    conversation: Optional[ConversationContext] = None,
+    check_cache: bool = True,
+    refresh: bool = False
 ) -> str:
     """
     Process user query and return the response
+    The query is routed to the cheapest agent chain that suits it (see query_router)
     If image_data is provided, includes image analysis in the response
+    If conversation is provided, earlier turns are included in each stage prompt
+    Pass check_cache=False when cached_response was already consulted
+    Pass refresh=True to regenerate without the response and stage caches; the new
+    answer replaces the cached one
+    """
+    try:
+        bucket = preamble_id(user_profile)
+        cacheable = not image_data and not conversation
+        if check_cache and not refresh:
+            cached = cached_response(user_query, user_profile, image_data, conversation)
+            if cached is not None:
+                return cached
+
+        decision = query_router.router.route(user_query, has_image=bool(image_data))
+        cache_hits: Set[str] = set()
+        result = await run_chat_pipeline(
+            user_query, user_profile, image_data, conversation, decision.route, cache_hits, refresh
+        )
+        metrics.record_stages(result.timings)
+        query_router.router.record(decision, result.timings, cache_hits)
+        response = result.outputs["final"]
+        if cacheable and response and not skipped_stages(result.outputs):
+            response_cache.set(user_query, bucket, response)
+        return response
+
+    except llm.LLMError:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to get chat response: {str(e)}")
+
+async def stream_chat_response(
+    user_query: str,
+    user_profile: Optional[UserProfile] = None,
+    image_data: bytes = None,
+    conversation: Optional[ConversationContext] = None,
+    check_cache: bool = True
+) -> AsyncIterator[Dict[str, str]]:
     """
+    Process user query and stream the response as events
+    Yields a "stage" event as each agent starts, then "token" events for the final answer
+    Pass check_cache=False when cached_response was already consulted
+    """
+    bucket = preamble_id(user_profile)
+    cacheable = not image_data and not conversation
+    if check_cache:
+        cached = cached_response(user_query, user_profile, image_data, conversation)
+        if cached is not None:
+            async for event in cached_events(cached):
+                yield event
+            return
+
+    decision = query_router.router.route(user_query, has_image=bool(image_data))
+    cache_hits: Set[str] = set()
+    pipeline = build_chat_pipeline(
+        user_query, user_profile, image_data, include_final=False, conversation=conversation,
+        route=decision.route, cache_hits=cache_hits
+    )
+    started: asyncio.Queue = asyncio.Queue()
+    run = asyncio.ensure_future(pipeline.run(on_stage_start=started.put_nowait))
+    # Wake the consumer once the pipeline finishes or fails
+    run.add_done_callback(lambda _: started.put_nowait(None))
     try:
-        # If image is provided, get vision analysis first
-        vision_analysis = ""
-        if image_data:
-            try:
-                image_base64 = await process_image(image_data)
-                vision_analysis = await get_vision_response(image_base64, user_query)
-                # Combine vision analysis with user query
-                user_query = f"{user_query}\n\nImage Analysis: {vision_analysis}"
-            except Exception as e:
-                print(f"Warning: Failed to process image: {str(e)}")
-        
-        # Generate response using Gemini
-        planning_analysis = await model.generate_content_async(PLANNING_AGENT_PROMPT.format(user_query=user_query))
-        final_analysis = await model.generate_content_async(ANALYSIS_AGENT_PROMPT.format(planning_output=planning_analysis, user_query=user_query))
-
-        # Determine response style based on user profile
-        response_style = ""
-        if user_profile:
-            if user_profile.verbal_score > user_profile.non_verbal_score:
-                response_style = """
-                Focus on providing detailed text explanations and story-based examples.
-                Break down concepts into clear, sequential steps.
-                Use analogies and metaphors to explain complex ideas.
-                Provide written examples and scenarios.
-                """
-            elif user_profile.non_verbal_score > user_profile.verbal_score:
-                response_style = """
-                Focus on interactive scaffolding and visual descriptions.
-                Use step-by-step guidance with clear checkpoints.
-                Incorporate spatial and pattern-based explanations.
-                Break complex tasks into smaller, manageable parts.
-                """
-            else:
-                response_style = """
-                Provide a balanced approach with both verbal and visual explanations.
-                Use concise explanations with supporting examples.
-                Combine text-based and pattern-based learning strategies.
-                """
-
-            # Add confidence level consideration
-            confidence_guidance = f"""
-            The user's self-assessment score is {user_profile.self_assessment}/10, indicating {'high' if user_profile.self_assessment > 7 else 'moderate' if user_profile.self_assessment > 4 else 'low'} confidence in non-verbal skills.
-            {'Provide additional encouragement and positive reinforcement.' if user_profile.self_assessment < 5 else 'Maintain supportive but direct communication.'}
-            """
-
-        prompt = f"""
-        You are a helpful AI assistant for helping students who has a disability called non-verbal learning to understand the concepts, understand ideas and solve the problems. Please provide a clear response to the following query:
-
-        User Profile Information:
-        {f'Age: {user_profile.age}' if user_profile else 'Age: Unknown'}
-        {f'Verbal Score: {user_profile.verbal_score}/2' if user_profile else ''}
-        {f'Non-verbal Score: {user_profile.non_verbal_score}/2' if user_profile else ''}
-        {f'Self-assessment Score: {user_profile.self_assessment}/10' if user_profile else ''}
-
-        Response Style Guidelines:
-        {response_style if user_profile else 'Provide a balanced approach to explanation.'}
-        {confidence_guidance if user_profile else ''}
-
-        User Query: {user_query}
-        Final Analysis: {final_analysis}
-        {f'Vision Analysis: {vision_analysis}' if image_data else ''}
-        
-        Please provide a helpful and informative response that matches the user's learning profile and needs.
-        """
-        response = await model.generate_content_async(prompt)
-        return response.text
-        
+        while True:
+            name = await started.get()
+            if name is None:
+                break
+            if name in AGENT_STAGES:
+                yield {"event": "stage", "data": name}
+        result = run.result()
+
+        yield {"event": "stage", "data": "final"}
+        chunks = []
+        final_start = time.perf_counter()
+        async for chunk in model_calls.stream(provider, result.outputs["prompt"], "final"):
+            chunks.append(chunk)
+            yield {"event": "token", "data": chunk}
+        metrics.record_stages({**result.timings, "final": time.perf_counter() - final_start})
+        query_router.router.record(decision, result.timings, cache_hits)
+        if cacheable and chunks and not skipped_stages(result.outputs):
+            response_cache.set(user_query, bucket, "".join(chunks))
+        yield {"event": "done", "data": ""}
+
     except Exception as e:
-        raise Exception(f"Failed to get chat response: {str(e)}") 
\ No newline at end of file
+        yield {"event": "error", "data": f"Failed to get chat response: {str(e)}"}
+    finally:
+        if not run.done():
+            run.cancel()
+
+def create_chat_session(db: Session, user_id: int, title: str = "New Chat") -> schemas.ChatSession:
+    """Create a new chat session for the user"""
+    return schemas.ChatSession.model_validate(chat_store.create_session(db, user_id, title))
+
+def get_chat_history(db: Session, user_id: int, cursor: Optional[str] = None, limit: int = 20) -> schemas.ChatHistory:
+    """A page of the user's chat sessions, most recently active first"""
+    sessions, next_cursor = chat_store.list_sessions(db, user_id, cursor, limit)
+    return schemas.ChatHistory(
+        user_id=str(user_id),
+        sessions=[schemas.ChatSession.model_validate(s) for s in sessions],
+        next_cursor=next_cursor
+    )
+
+def get_session_messages(
+    db: Session,
+    user_id: int,
+    session_id: str,
+    cursor: Optional[str] = None,
+    limit: int = 50
+) -> Optional[schemas.ChatMessagePage]:
+    """A page of a session's messages, or None if the user has no such session"""
+    if chat_store.get_session(db, user_id, session_id) is None:
+        return None
+    messages, next_cursor = chat_store.list_messages(db, session_id, cursor, limit)
+    return schemas.ChatMessagePage(
+        session_id=session_id,
+        messages=[schemas.ChatMessageResponse.model_validate(m) for m in messages],
+        next_cursor=next_cursor
+    )
+
+def save_chat_message(db: Session, user_id: int, session_id: Optional[str], content: str, response: str) -> datetime:
+    """Record one exchange in the user's history; returns its timestamp"""
+    return chat_store.append_message(db, user_id, session_id, content, response).created_at
+
+def delete_chat_session(db: Session, user_id: int, session_id: str) -> bool:
+    """Delete a chat session and its messages"""
+    return chat_store.delete_session(db, user_id, session_id)
@@ -0,0 +1,141 @@
+import os
+from typing import Awaitable, Callable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from database import run_in_session, write_in_session
+from singleflight import SingleFlight
+import chat_store
+import models
+
+# Most recent exchanges sent to the model verbatim
+RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "4"))
+
+# Token budget for the conversation context in each stage prompt
+STAGE_TOKEN_BUDGETS = {
+    "planning": int(os.getenv("CONTEXT_BUDGET_PLANNING", "600")),
+    "analysis": int(os.getenv("CONTEXT_BUDGET_ANALYSIS", "400")),
+    "final": int(os.getenv("CONTEXT_BUDGET_FINAL", "1200")),
+}
+
+# Upper bound on the rolling summary itself
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CONTEXT_SUMMARY_BUDGET", "400"))
+
+# Older exchanges folded into the summary per update
+SUMMARY_BATCH = 20
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a tutoring conversation with a student.
+Update the summary with the new exchanges below. Keep the topics covered, what the student
+found difficult, what was already explained, and any open questions. Write at most {max_words} words.
+
+CURRENT SUMMARY: {summary}
+
+NEW EXCHANGES:
+{turns}
+"""
+
+_summary_updates = SingleFlight()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token), good enough for budgeting"""
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cut text to roughly `budget` tokens"""
+    limit = budget * 4
+    if len(text) <= limit:
+        return text
+    if budget <= 0:
+        return ""
+    return text[:limit - 3] + "..."
+
+class ConversationContext:
+    """Rolling summary of older turns plus the most recent (question, answer) turns"""
+
+    def __init__(self, summary: str = "", turns: Optional[List[Tuple[str, str]]] = None):
+        self.summary = summary
+        self.turns = turns or []
+
+    def __bool__(self) -> bool:
+        return bool(self.summary or self.turns)
+
+    def render(self, budget: int) -> str:
+        """Context text within a token budget; the oldest turns are dropped first, then the summary is cut"""
+        if not self or budget <= 0:
+            return ""
+        # Each turn may use at most half the budget, so one long answer can't crowd out the rest
+        per_turn = max(budget // 2, 1)
+        rendered_turns = [
+            f"Student: {truncate_to_tokens(question, per_turn // 2)}\n"
+            f"Tutor: {truncate_to_tokens(answer, per_turn // 2)}"
+            for question, answer in self.turns
+        ]
+
+        kept: List[str] = []
+        used = 0
+        for turn in reversed(rendered_turns):
+            cost = estimate_tokens(turn)
+            if used + cost > budget:
+                break
+            kept.insert(0, turn)
+            used += cost
+
+        parts = []
+        if self.summary and used < budget:
+            parts.append("Summary of earlier conversation: " + truncate_to_tokens(self.summary, budget - used))
+        if kept:
+            parts.append("Recent exchanges:\n" + "\n".join(kept))
+        return "\n".join(parts)
+
+def load_context(db: Session, session_id: str, recent_turns: int = RECENT_TURNS) -> ConversationContext:
+    """Rolling summary and last turns of a session, from one indexed read each"""
+    session = db.get(models.ChatSession, session_id)
+    if session is None:
+        return ConversationContext()
+    messages, _ = chat_store.list_messages(db, session_id, limit=recent_turns)
+    return ConversationContext(
+        summary=session.summary or "",
+        turns=[(m.content or "", m.response or "") for m in messages]
+    )
+
+def _pending_summary(db: Session, session_id: str, recent_turns: int) -> Optional[Tuple[str, int, str]]:
+    """Current summary, last message to fold in and the turns to fold, or None if nothing is due"""
+    session = db.get(models.ChatSession, session_id)
+    if session is None:
+        return None
+    recent, _ = chat_store.list_messages(db, session_id, limit=recent_turns)
+    if not recent:
+        return None
+    # Fold everything older than the recent window that isn't summarized yet
+    older = chat_store.list_unsummarized_messages(
+        db, session_id, session.summarized_through_id or 0, recent[0].id, SUMMARY_BATCH
+    )
+    if not older:
+        return None
+    turns = "\n".join(
+        f"Student: {truncate_to_tokens(m.content or '', 200)}\nTutor: {truncate_to_tokens(m.response or '', 300)}"
+        for m in older
+    )
+    return session.summary or "", older[-1].id, turns
+
+async def _update_summary(session_id: str, generate: Callable[[str], Awaitable[str]], recent_turns: int):
+    # Separate sessions for the read and the write, so no connection is held while the model runs
+    pending = await run_in_session(_pending_summary, session_id, recent_turns)
+    if pending is None:
+        return
+    summary, summarized_through_id, turns = pending
+    summary = await generate(SUMMARY_PROMPT.format(
+        max_words=SUMMARY_TOKEN_BUDGET * 3 // 4,
+        summary=summary or "None yet",
+        turns=turns
+    ))
+    await write_in_session(
+        chat_store.save_summary, session_id, truncate_to_tokens(summary, SUMMARY_TOKEN_BUDGET), summarized_through_id
+    )
+
+def schedule_summary_update(
+    session_id: str,
+    generate: Callable[[str], Awaitable[str]],
+    recent_turns: int = RECENT_TURNS
+):
+    """Fold turns that left the recent window into the summary, in the background, one update per session at a time"""
+    _summary_updates.start(session_id, lambda: _update_summary(session_id, generate, recent_turns))
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+import models
+
+# Maximum number of cached explanations; least recently read entries are evicted
+MAX_ENTRIES = int(os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", "5000"))
+
+# Reads refresh last_accessed_at at most this often, so hot entries don't write on every GET
+ACCESS_TOUCH_INTERVAL = timedelta(seconds=60)
+
+def make_etag(explanation: str) -> str:
+    return '"' + hashlib.sha256(explanation.encode("utf-8")).hexdigest()[:32] + '"'
+
+def get_explanation(db: Session, subcategory: str) -> Optional[models.ExplanationCache]:
+    """
+    Look up a cached explanation and record the access for LRU eviction
+    Returns a detached entry and ends the transaction, so callers can await
+    slow work without holding a pooled connection
+    """
+    entry = db.get(models.ExplanationCache, subcategory)
+    if entry is None:
+        db.rollback()
+        return None
+    now = datetime.utcnow()
+    if entry.last_accessed_at is None or now - entry.last_accessed_at > ACCESS_TOUCH_INTERVAL:
+        entry.last_accessed_at = now
+        db.flush()
+    db.expunge(entry)
+    db.commit()
+    return entry
+
+def cached_subcategories(db: Session) -> Set[str]:
+    """Subcategories with a stored explanation; a plain read that doesn't count as an access"""
+    subcategories = {subcategory for subcategory, in db.query(models.ExplanationCache.subcategory)}
+    db.rollback()
+    return subcategories
+
+def put_explanation(db: Session, subcategory: str, explanation: str) -> str:
+    """Atomically insert or replace one explanation and return its ETag"""
+    now = datetime.utcnow()
+    etag = make_etag(explanation)
+    statement = insert(models.ExplanationCache).values(
+        subcategory=subcategory,
+        explanation=explanation,
+        etag=etag,
+        updated_at=now,
+        last_accessed_at=now
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[models.ExplanationCache.subcategory],
+        set_={
+            "explanation": statement.excluded.explanation,
+            "etag": statement.excluded.etag,
+            "updated_at": statement.excluded.updated_at,
+            "last_accessed_at": statement.excluded.last_accessed_at,
+        }
+    ))
+    db.commit()
+    evict_least_recently_used(db)
+    return etag
+
+def evict_least_recently_used(db: Session, max_entries: int = None) -> int:
+    """Delete the least recently read entries beyond max_entries"""
+    max_entries = MAX_ENTRIES if max_entries is None else max_entries
+    excess = db.query(func.count(models.ExplanationCache.subcategory)).scalar() - max_entries
+    if excess <= 0:
+        return 0
+    oldest = db.query(models.ExplanationCache.subcategory).order_by(
+        models.ExplanationCache.last_accessed_at.asc()
+    ).limit(excess)
+    deleted = db.query(models.ExplanationCache).filter(
+        models.ExplanationCache.subcategory.in_(oldest.scalar_subquery())
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def import_json_cache(db: Session, path: str) -> int:
+    """Import a legacy subject_cache.json file, keeping any entries already in the store"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r') as f:
+        entries: Dict[str, str] = json.load(f)
+    if not entries:
+        return 0
+
+    now = datetime.utcnow()
+    statement = insert(models.ExplanationCache).values([
+        {
+            "subcategory": subcategory,
+            "explanation": explanation,
+            "etag": make_etag(explanation),
+            "updated_at": now,
+            "last_accessed_at": now,
+        }
+        for subcategory, explanation in entries.items()
+    ])
+    result = db.execute(statement.on_conflict_do_nothing(
+        index_elements=[models.ExplanationCache.subcategory]
+    ))
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from database import run_in_session, write_in_session
+from singleflight import SingleFlight
+from ttl_cache import TTLCache
+import admission
+import chatbot
+import models
+import schemas
+
+# Bump when FLASHCARD_PROMPT or the validation rules change; older decks are then regenerated
+DECK_VERSION = 1
+
+# Cards requested per deck, and the fewest a valid deck may have
+DECK_SIZE = int(os.getenv("FLASHCARD_DECK_SIZE", "12"))
+MIN_CARDS = int(os.getenv("FLASHCARD_MIN_CARDS", "5"))
+
+# Longest accepted card sides, in characters
+MAX_FRONT_CHARS = 200
+MAX_BACK_CHARS = 600
+
+# Attempts at a valid deck before giving up (each is one model call)
+MAX_ATTEMPTS = 2
+
+# Generations running at once for a batch request
+BATCH_CONCURRENCY = int(os.getenv("FLASHCARD_BATCH_CONCURRENCY", "4"))
+MAX_BATCH_SIZE = 50
+
+# Topics from the catalog listed in the prompt, to keep the deck on the subcategory's syllabus
+MAX_PROMPT_TOPICS = 15
+
+FLASHCARD_PROMPT = """
+You write study flashcards for students.
+Create {count} flashcards about "{subcategory}".
+Topics to cover: {topics}
+
+Tailor the wording to this student:
+{style}
+
+Respond with JSON only, in exactly this form:
+{{"cards": [{{"front": "question or term", "back": "short answer or explanation"}}]}}
+Each front is one question or term. Each back answers it in one to three sentences.
+Do not repeat a question.
+"""
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+class DeckError(ValueError):
+    """The model's response is not a usable deck"""
+
+# Decks never change once written, so hot ones are served from memory without expiry
+_deck_cache = TTLCache(maxsize=int(os.getenv("FLASHCARD_CACHE_SIZE", "2048")))
+
+# At most one generation per (subcategory, profile bucket) at a time
+_generations = SingleFlight()
+
+def parse_deck(text: str, count: int = DECK_SIZE) -> List[schemas.Flashcard]:
+    """Parse and validate a model response into at most count unique cards"""
+    try:
+        data = json.loads(_FENCE.sub("", (text or "").strip()))
+    except ValueError as e:
+        raise DeckError(f"Response is not JSON: {e}")
+    items = data.get("cards") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise DeckError("Response has no list of cards")
+
+    cards = []
+    seen = set()
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        front, back = item.get("front"), item.get("back")
+        if not isinstance(front, str) or not isinstance(back, str):
+            continue
+        front, back = " ".join(front.split()), back.strip()
+        if not front or not back or len(front) > MAX_FRONT_CHARS or len(back) > MAX_BACK_CHARS:
+            continue
+        if front.lower() in seen:
+            continue
+        seen.add(front.lower())
+        cards.append(schemas.Flashcard(front=front, back=back))
+        if len(cards) == count:
+            break
+    if len(cards) < min(MIN_CARDS, count):
+        raise DeckError(f"Only {len(cards)} valid cards")
+    return cards
+
+def get_deck(db: Session, subcategory: str, preamble_id: str) -> Optional[List[schemas.Flashcard]]:
+    deck = db.get(models.FlashcardDeck, (subcategory, preamble_id, DECK_VERSION))
+    cards = json.loads(deck.cards) if deck is not None else None
+    db.rollback()
+    return [schemas.Flashcard(**card) for card in cards] if cards is not None else None
+
+def put_deck(db: Session, subcategory: str, preamble_id: str, cards: List[schemas.Flashcard]):
+    statement = insert(models.FlashcardDeck).values(
+        subcategory=subcategory,
+        preamble_id=preamble_id,
+        version=DECK_VERSION,
+        cards=json.dumps([card.model_dump() for card in cards]),
+        created_at=datetime.utcnow()
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[
+            models.FlashcardDeck.subcategory, models.FlashcardDeck.preamble_id, models.FlashcardDeck.version
+        ],
+        set_={"cards": statement.excluded.cards, "created_at": statement.excluded.created_at}
+    ))
+    db.commit()
+
+def build_prompt(subcategory: str, topics: Iterable[str], preamble_id: str) -> str:
+    return FLASHCARD_PROMPT.format(
+        count=DECK_SIZE,
+        subcategory=subcategory,
+        topics=", ".join(list(topics)[:MAX_PROMPT_TOPICS]) or subcategory,
+        style=chatbot.PREAMBLES.get(preamble_id, chatbot.PREAMBLES[chatbot.DEFAULT_PREAMBLE_ID]).strip()
+    )
+
+async def _generate(subcategory: str, topics: List[str], preamble_id: str) -> List[schemas.Flashcard]:
+    prompt = build_prompt(subcategory, topics, preamble_id)
+    error: Optional[DeckError] = None
+    for _ in range(MAX_ATTEMPTS):
+        # One admission slot per generation, however many readers are waiting on it
+        async with admission.controller.admit():
+            text = await chatbot.model_calls.generate(chatbot.provider, prompt, "flashcards", json_output=True)
+        try:
+            cards = parse_deck(text)
+        except DeckError as e:
+            print(f"Warning: Invalid flashcard deck for {subcategory}: {e}")
+            error = e
+            continue
+        await write_in_session(put_deck, subcategory, preamble_id, cards)
+        _deck_cache.set((subcategory, preamble_id), cards)
+        return cards
+    raise error
+
+async def cached_deck(subcategory: str, preamble_id: str) -> Optional[List[schemas.Flashcard]]:
+    """A stored deck from memory or the database, without generating"""
+    key = (subcategory, preamble_id)
+    cards = _deck_cache.get(key)
+    if cards is None:
+        cards = await run_in_session(get_deck, subcategory, preamble_id)
+        if cards is not None:
+            _deck_cache.set(key, cards)
+    return cards
+
+async def get_or_generate(subcategory: str, topics: List[str], preamble_id: str) -> List[schemas.Flashcard]:
+    """The deck for a subcategory and profile bucket, generated with one model call on a miss"""
+    cards = await cached_deck(subcategory, preamble_id)
+    if cards is not None:
+        return cards
+    return await _generations.do((subcategory, preamble_id), lambda: _generate(subcategory, topics, preamble_id))
+
+async def generate_batch(
+    subcategories: Dict[str, List[str]],
+    preamble_id: str,
+    concurrency: int = BATCH_CONCURRENCY
+) -> Dict[str, str]:
+    """Make sure each subcategory (name -> topics) has a deck, at most `concurrency` generating at once"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(subcategory: str, topics: List[str]) -> str:
+        if await cached_deck(subcategory, preamble_id) is not None:
+            return "cached"
+        async with semaphore:
+            try:
+                await get_or_generate(subcategory, topics, preamble_id)
+            except Exception as e:
+                print(f"Flashcard error for {subcategory}: {e}")  # Log the error
+                return "failed"
+        return "generated"
+
+    names = list(subcategories)
+    results = await asyncio.gather(*(one(name, subcategories[name]) for name in names))
+    return dict(zip(names, results))
@@ -0,0 +1,15 @@
+from typing import Optional
+from fastapi import Response
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches the current ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    """Empty 304 response for a matching conditional GET"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+from fastapi import UploadFile
+from PIL import Image
+
+# Uploads larger than this are rejected before they are decoded
+MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(8 * 1024 * 1024)))
+
+# Images with more pixels are downscaled before they are sent to the vision model
+MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(1600 * 1200)))
+
+# Images claiming more pixels than this are refused outright (decompression bombs)
+MAX_SOURCE_PIXELS = int(os.getenv("IMAGE_MAX_SOURCE_PIXELS", str(50_000_000)))
+
+JPEG_QUALITY = 85
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Decoding and resizing are CPU-bound; Pillow releases the GIL, so a small pool runs them off the event loop
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+_image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+# Formats the vision model accepts as-is, by magic bytes
+PASS_THROUGH_FORMATS = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+)
+
+class ImageError(ValueError):
+    """The upload is not a usable image"""
+
+class UploadTooLarge(ImageError):
+    """The upload exceeds MAX_UPLOAD_BYTES"""
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    # sha256 of the uploaded bytes, so identical uploads share cached vision results
+    digest: str
+
+async def read_upload(upload: UploadFile, limit: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload in chunks, giving up as soon as it passes the limit"""
+    if upload.size is not None and upload.size > limit:
+        raise UploadTooLarge(f"Image is larger than {limit // (1024 * 1024)} MB")
+    chunks = []
+    size = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            raise UploadTooLarge(f"Image is larger than {limit // (1024 * 1024)} MB")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def _sniff(data: bytes) -> Optional[str]:
+    for magic, mime_type in PASS_THROUGH_FORMATS:
+        if data.startswith(magic):
+            return mime_type
+    return None
+
+def _prepare(data: bytes, max_pixels: int) -> PreparedImage:
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        # Opening only parses the header; pixels are decoded on demand
+        with Image.open(BytesIO(data)) as image:
+            width, height = image.size
+            if width * height > MAX_SOURCE_PIXELS:
+                raise ImageError(f"Image is too large ({width}x{height})")
+
+            mime_type = _sniff(data)
+            if mime_type and width * height <= max_pixels:
+                return PreparedImage(data, mime_type, digest)
+
+            scale = min(1.0, math.sqrt(max_pixels / (width * height)))
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            # JPEG can decode straight at a reduced scale, which is much cheaper than decoding in full
+            image.draft("RGB", size)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail(size, Image.Resampling.LANCZOS)
+
+            buffered = BytesIO()
+            image.save(buffered, format="JPEG", quality=JPEG_QUALITY)
+            return PreparedImage(buffered.getvalue(), "image/jpeg", digest)
+    except ImageError:
+        raise
+    except Exception as e:
+        raise ImageError(f"Unreadable image: {str(e)}")
+
+async def prepare_image(data: bytes, max_pixels: int = MAX_PIXELS) -> PreparedImage:
+    """
+    Make uploaded bytes ready for the vision model
+    JPEG and PNG within the pixel budget pass through unchanged; anything else is
+    downscaled and re-encoded as JPEG in the image worker pool
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_image_executor, _prepare, data, max_pixels)
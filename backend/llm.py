@@ -0,0 +1,139 @@
+import os
+import asyncio
+import hashlib
+import json
+import random
+from typing import AsyncIterator, List, Optional, Union
+
+# A prompt is either plain text or a list of parts (text and image dicts)
+Prompt = Union[str, List[Union[str, dict]]]
+
+DEFAULT_GEMINI_MODEL = "gemini-2.0-flash"
+
+class LLMError(Exception):
+    """Raised when a provider fails to generate a response"""
+    pass
+
+class LLMProvider:
+    """Interface for the language model backends used by the chatbot"""
+    name = "base"
+
+    async def generate(self, prompt: Prompt) -> str:
+        """Generate the full response text for a prompt"""
+        raise NotImplementedError
+
+    async def generate_json(self, prompt: Prompt) -> str:
+        """Generate a response constrained to JSON, where the backend supports it"""
+        return await self.generate(prompt)
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        """Stream the response text for a prompt in chunks"""
+        yield await self.generate(prompt)
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini backend"""
+    name = "gemini"
+
+    def __init__(self, model_name: str = DEFAULT_GEMINI_MODEL, api_key: Optional[str] = None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        self.model = genai.GenerativeModel(model_name)
+
+    async def generate(self, prompt: Prompt) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+    async def generate_json(self, prompt: Prompt) -> str:
+        response = await self.model.generate_content_async(
+            prompt, generation_config={"response_mime_type": "application/json"}
+        )
+        return response.text
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+class StubProvider(LLMProvider):
+    """
+    Local deterministic backend for benchmarks and load tests
+    Responses depend only on the prompt; latency, token rate and failures are configurable
+    """
+    name = "stub"
+
+    WORDS = [
+        "concept", "step", "example", "shape", "number", "pattern", "idea", "rule",
+        "picture", "practice", "question", "answer", "reason", "part", "whole", "check",
+    ]
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        tokens_per_second: float = 200.0,
+        response_tokens: int = 60,
+        failure_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    def _tokens(self, prompt: Prompt) -> List[str]:
+        text = prompt if isinstance(prompt, str) else " ".join(p for p in prompt if isinstance(p, str))
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [
+            self.WORDS[digest[i % len(digest)] % len(self.WORDS)]
+            for i in range(self.response_tokens)
+        ]
+
+    async def _before_first_token(self):
+        await asyncio.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise LLMError("Injected stub failure")
+
+    async def generate(self, prompt: Prompt) -> str:
+        tokens = self._tokens(prompt)
+        await self._before_first_token()
+        if self.tokens_per_second:
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+        return " ".join(tokens)
+
+    async def generate_json(self, prompt: Prompt) -> str:
+        # Question/answer pairs built from the same deterministic words
+        tokens = self._tokens(prompt)
+        await self._before_first_token()
+        if self.tokens_per_second:
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+        cards = [
+            {"front": f"What is the {tokens[i]} of the {tokens[i + 1]}?", "back": " ".join(tokens[i + 2:i + 6])}
+            for i in range(0, len(tokens) - 5, 6)
+        ]
+        return json.dumps({"cards": cards})
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        tokens = self._tokens(prompt)
+        await self._before_first_token()
+        delay = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        for token in tokens:
+            if delay:
+                await asyncio.sleep(delay)
+            yield token + " "
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """Create the provider selected by LLM_PROVIDER ("gemini" or "stub")"""
+    name = (name or os.getenv("LLM_PROVIDER", "gemini")).lower()
+    if name == "gemini":
+        return GeminiProvider(os.getenv("GEMINI_MODEL", DEFAULT_GEMINI_MODEL))
+    if name == "stub":
+        return StubProvider(
+            latency=float(os.getenv("STUB_LATENCY_MS", "200")) / 1000,
+            tokens_per_second=float(os.getenv("STUB_TOKENS_PER_SECOND", "200")),
+            response_tokens=int(os.getenv("STUB_RESPONSE_TOKENS", "60")),
+            failure_rate=float(os.getenv("STUB_FAILURE_RATE", "0")),
+            seed=int(os.getenv("STUB_SEED", "0"))
+        )
+    raise ValueError(f"Unknown LLM provider: {name}")
@@ -1,5 +1,8 @@
+import json
+import math
+from contextlib import asynccontextmanager
 from datetime import timedelta
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, Form, File
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, Form, File, Query
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
@@ -7,16 +10,56 @@ import models
 import schemas
 import auth
 import chatbot
-from database import engine, get_db
-from typing import Optional
-from fastapi.responses import JSONResponse
-from chatbot import get_chat_response, UserProfile
-from routes import subjects, cache
+from llm import LLMError
+from database import engine, get_db, get_async_db, write_in_session, AsyncDB
+from typing import Optional, Tuple
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from chatbot import cached_response, cached_events, get_chat_response, stream_chat_response, UserProfile
+from routes import subjects, cache, flashcards, scores, tutorials, study_time as study_time_routes
+import admission
+import chat_store
+import conversation
+import image_pipeline
+import metrics
+import profiles
+import query_router
+import scoring
+import study_time
+import tutorial_views
 
 # Create the database tables
 models.Base.metadata.create_all(bind=engine)
+chat_store.ensure_schema(engine)
+study_time.ensure_schema(engine)
+tutorial_views.ensure_schema(engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    buffers = (study_time.buffer, tutorial_views.buffer)
+    for buffer in buffers:
+        buffer.start()
+    scoring.engine.start()
+    try:
+        yield
+    finally:
+        await scoring.engine.stop()
+        # Write everything still buffered before the process exits
+        for buffer in buffers:
+            await buffer.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+# Largest chat request accepted: the image limit plus room for the other form fields
+MAX_CHAT_REQUEST_BYTES = image_pipeline.MAX_UPLOAD_BYTES + 64 * 1024
+
+@app.middleware("http")
+async def limit_chat_request_size(request, call_next):
+    """Turn away oversized chat uploads before their body is read"""
+    if request.url.path in ("/chat", "/chat/stream"):
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > MAX_CHAT_REQUEST_BYTES:
+            return JSONResponse(status_code=413, content={"detail": "Request is too large"})
+    return await call_next(request)
 
 # Configure CORS
 app.add_middleware(
@@ -28,38 +71,126 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Added last so it is outermost and times everything, CORS and the size limit included
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Gauges for state owned by other modules, read at scrape time
+CACHES = {
+    "response": chatbot.response_cache.stats,
+    "stage": chatbot.stage_cache.stats,
+    "vision": chatbot.vision_cache.stats,
+    "token": auth._token_cache.stats,
+    "principal": auth._principal_cache.stats,
+    "profile": profiles._profile_cache.stats,
+}
+
+def _cache_stat(field: str):
+    return lambda: {(name,): stats()[field] for name, stats in CACHES.items()}
+
+def _cache_lookups():
+    lookups = {}
+    for name, stats in CACHES.items():
+        values = stats()
+        hits = values.get("hits", values.get("exact_hits", 0) + values.get("similar_hits", 0))
+        lookups[(name, "hit")] = hits
+        lookups[(name, "miss")] = values["misses"]
+    return lookups
+
+metrics.callback("cache_size", "Entries held in each in-process cache", _cache_stat("size"), ("cache",))
+metrics.callback("cache_hit_ratio", "Hit ratio of each in-process cache since start", _cache_stat("hit_ratio"), ("cache",))
+metrics.callback(
+    "cache_lookups_total", "Lookups of each in-process cache by result", _cache_lookups, ("cache", "result"), "counter"
+)
+metrics.callback("admission_active", "Model-backed requests running", lambda: admission.controller.stats()["active"])
+metrics.callback("admission_queue_depth", "Requests waiting for a model slot", lambda: admission.controller.stats()["queue_depth"])
+metrics.callback(
+    "admission_wait_seconds", "Recent admission wait percentiles",
+    lambda: {
+        (quantile,): admission.controller.stats()[f"wait_p{quantile[2:]}_ms"] / 1000
+        for quantile in ("0.50", "0.95")
+    },
+    ("quantile",)
+)
+metrics.callback(
+    "admission_rejections_total", "Requests turned away by admission control",
+    lambda: {(reason,): admission.controller.counts[reason] for reason in ("rate_limited", "queue_full", "shed", "timed_out")},
+    ("reason",), "counter"
+)
+metrics.callback("password_hash_in_flight", "Password hashes running or queued", lambda: auth.hashing_stats()["in_flight"])
+metrics.callback("password_hash_queue_depth", "Password hashes waiting for a worker", lambda: auth.hashing_stats()["queue_depth"])
+metrics.callback(
+    "model_call_events_total", "Model call retries, timeouts, hedges and circuit-breaker rejections",
+    lambda: {(event,): count for event, count in chatbot.model_calls.counts.items()},
+    ("event",), "counter"
+)
+metrics.callback(
+    "study_time_pending_users", "Users with study time not yet written",
+    lambda: study_time.buffer.stats()["pending_users"]
+)
+metrics.callback(
+    "study_time_rows_written_total", "Daily rollup rows upserted by study-time flushes",
+    lambda: study_time.buffer.counts["rows_written"], kind="counter"
+)
+metrics.callback(
+    "tutorial_views_pending", "Tutorial views not yet written",
+    lambda: tutorial_views.buffer.stats()["pending_views"]
+)
+metrics.callback(
+    "query_router_stage_avg_seconds", "Running average latency of each agent stage, used to estimate routing savings",
+    lambda: {(stage,): ms / 1000 for stage, ms in query_router.router.stats()["stage_avg_ms"].items()},
+    ("stage",)
+)
+metrics.callback(
+    "model_breaker_open", "1 while the model circuit breaker is open or half open",
+    lambda: 0 if chatbot.model_calls.breaker.state == "closed" else 1
+)
+
+def include_router(router, prefix: str, tags: list):
+    """Include a router, keeping its routes' full paths for the metrics labels"""
+    app.include_router(router, prefix=prefix, tags=tags)
+    metrics.register_router(router, prefix)
+
 # Include routers
-app.include_router(subjects.router, prefix="/api/subjects", tags=["subjects"])
-app.include_router(cache.router, prefix="/api/cache", tags=["cache"])
+include_router(subjects.router, prefix="/api/subjects", tags=["subjects"])
+include_router(cache.router, prefix="/api/cache", tags=["cache"])
+include_router(flashcards.router, prefix="/api/flashcards", tags=["flashcards"])
+include_router(scores.router, prefix="/api/scores", tags=["scores"])
+include_router(tutorials.router, prefix="/api/tutorials", tags=["tutorials"])
+include_router(study_time_routes.router, prefix="/api/study-time", tags=["study-time"])
+
+def _get_user_by_email(db: Session, email: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def _save(db: Session, instance):
+    """Add or update one row and return it refreshed"""
+    db.add(instance)
+    db.commit()
+    db.refresh(instance)
+    return instance
 
 @app.post("/signup", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncDB = Depends(get_async_db)):
     # Check if username exists
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if db_user:
+    if await db.run(auth.get_user, user.username):
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # Check if email exists
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if db_user:
+    if await db.run(_get_user_by_email, user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await auth.get_password_hash_async(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await db.write(_save, db_user)
 
 @app.post("/login", response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncDB = Depends(get_async_db)):
     # Find user by username
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
+    user = await db.run(auth.get_user, form_data.username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -68,12 +199,18 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         )
     
     # Verify password
-    if not auth.verify_password(form_data.password, user.hashed_password):
+    if not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Upgrade legacy or outdated hashes to the current format and cost
+    if auth.needs_rehash(user.hashed_password):
+        user.hashed_password = await auth.get_password_hash_async(form_data.password)
+        await db.write(_save, user)
+        auth.invalidate_user(user.username)
     
     # Create access token
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -103,6 +240,7 @@ def create_learning_profile(
     db.add(db_profile)
     db.commit()
     db.refresh(db_profile)
+    profiles.invalidate_profile(current_user.id)
     return db_profile
 
 @app.get("/assessment/profile", response_model=schemas.LearningProfile)
@@ -136,6 +274,7 @@ def update_learning_profile(
     
     db.commit()
     db.refresh(existing_profile)
+    profiles.invalidate_profile(current_user.id)
     return existing_profile
 
 @app.delete("/assessment/profile", response_model=dict)
@@ -152,17 +291,18 @@ def delete_learning_profile(
     
     db.delete(profile)
     db.commit()
+    profiles.invalidate_profile(current_user.id)
     return {"message": "Learning profile deleted successfully"}
 
-@app.post("/api/chat/sessions")
+@app.post("/api/chat/sessions", response_model=schemas.ChatSession)
 async def create_session(
     title: str = "New Chat",
-    user_id: str = Form("default_user")
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
 ):
     """Create a new chat session"""
     try:
-        session = chatbot.create_chat_session(user_id, title)
-        return session
+        return await db.write(chatbot.create_chat_session, current_user.id, title)
     except Exception as e:
         print(f"Error creating session: {e}")
         return JSONResponse(
@@ -170,48 +310,105 @@ async def create_session(
             content={"error": "Failed to create session"}
         )
 
-@app.get("/chat/history")
-async def get_history(current_user: models.User = Depends(auth.get_current_user)):
-    """Get all chat history for the current user"""
-    history = chatbot.get_chat_history(str(current_user.id))
-    return history
+@app.get("/chat/history", response_model=schemas.ChatHistory)
+async def get_history(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Get a page of chat sessions for the current user"""
+    try:
+        return await db.run(chatbot.get_chat_history, current_user.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/chat/sessions/{session_id}/messages", response_model=schemas.ChatMessagePage)
+async def get_session_messages(
+    session_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Get a page of messages in a chat session, newest page first"""
+    try:
+        page = await db.run(chatbot.get_session_messages, current_user.id, session_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return page
+
+def _load_conversation(db: Session, user_id: int, session_id: Optional[str]) -> Optional[conversation.ConversationContext]:
+    """Earlier turns of the session, or None for a one-off message"""
+    if not session_id:
+        return None
+    if chat_store.get_session(db, user_id, session_id) is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return conversation.load_context(db, session_id)
+
+def _load_chat_context(
+    db: Session,
+    user_id: int,
+    session_id: Optional[str]
+) -> Tuple[Optional[UserProfile], Optional[conversation.ConversationContext]]:
+    """Everything a chat request reads from the database, in one trip off the event loop"""
+    history = _load_conversation(db, user_id, session_id)
+    user_profile = profiles.load_user_profile(db, user_id)
+    # End the read transaction so no connection or stale snapshot is held while the model runs
+    db.rollback()
+    return user_profile, history
+
+async def _read_image(image: Optional[UploadFile]) -> Optional[bytes]:
+    """Read an image upload, refusing oversized ones"""
+    if not image:
+        return None
+    try:
+        return await image_pipeline.read_upload(image)
+    except image_pipeline.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
 @app.post("/chat")
 async def chat(
     message: str = Form(...),
     image: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db),
+    session_id: Optional[str] = Form(None),
+    db: AsyncDB = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
+    # Get user's learning profile and the session's earlier turns
+    user_profile, history = await db.run(_load_chat_context, current_user.id, session_id)
+    image_data = await _read_image(image)
     try:
-        # Get user's learning profile
-        profile = db.query(models.LearningProfile).filter(
-            models.LearningProfile.user_id == current_user.id
-        ).first()
-
-        # Convert profile to UserProfile if it exists
-        user_profile = None
-        if profile:
-            user_profile = UserProfile(
-                verbal_score=profile.verbal_score,
-                non_verbal_score=profile.non_verbal_score,
-                self_assessment=profile.self_assessment,
-                age=profile.age
-            )
-
-        # Process image if provided
-        image_data = None
-        if image:
-            image_data = await image.read()
-
-        # Get response from chatbot
-        response = await get_chat_response(
-            user_query=message,
-            user_profile=user_profile,
-            image_data=image_data
-        )
+        # Cached answers skip admission; anything else waits for a model slot (429/503 with Retry-After when overloaded)
+        response = cached_response(message, user_profile, image_data, history)
+        if response is None:
+            async with admission.controller.admit(current_user.id):
+                response = await get_chat_response(
+                    user_query=message,
+                    user_profile=user_profile,
+                    image_data=image_data,
+                    conversation=history,
+                    check_cache=False
+                )
 
-        return {"response": response if response else "I'm sorry, I couldn't generate a response."}
+        if not response:
+            return {"response": "I'm sorry, I couldn't generate a response."}
+        if session_id:
+            created_at = await db.write(chatbot.save_chat_message, current_user.id, session_id, message, response)
+            conversation.schedule_summary_update(session_id, chatbot.summarize)
+            scoring.engine.record_chat(current_user.id, message, created_at)
+        return {"response": response}
+    except HTTPException:
+        raise
+    except LLMError as e:
+        print(f"Chat error: {e}")  # Log the error
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The tutor is temporarily unavailable, please try again",
+            headers={"Retry-After": str(math.ceil(getattr(e, "retry_after", 1)))}
+        )
     except Exception as e:
         print(f"Chat error: {e}")  # Log the error
         raise HTTPException(
@@ -219,15 +416,101 @@ async def chat(
             detail=str(e)
         )
 
+class _ReleasingStreamingResponse(StreamingResponse):
+    """
+    Calls release once the response is over, however it ends: the body generator's own
+    cleanup never runs if the client leaves before the body starts
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+@app.post("/chat/stream")
+async def chat_stream(
+    message: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    session_id: Optional[str] = Form(None),
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Stream the chat response as server-sent events"""
+    user_id = current_user.id
+    user_profile, history = await db.run(_load_chat_context, user_id, session_id)
+    image_data = await _read_image(image)
+    cached = cached_response(message, user_profile, image_data, history)
+    # Admit before the response starts, so overload is reported as 429/503 rather than mid-stream;
+    # cached answers need no model slot
+    ticket = await admission.controller.acquire(user_id) if cached is None else None
+    if cached is not None:
+        events = cached_events(cached)
+    else:
+        events = stream_chat_response(
+            user_query=message,
+            user_profile=user_profile,
+            image_data=image_data,
+            conversation=history,
+            check_cache=False
+        )
+
+    def release():
+        if ticket is not None:
+            ticket.release()
+
+    async def event_stream():
+        chunks = []
+        try:
+            async for event in events:
+                if event["event"] == "error":
+                    print(f"Chat error: {event['data']}")  # Log the error
+                elif event["event"] == "token":
+                    chunks.append(event["data"])
+                elif event["event"] == "done":
+                    release()
+                    if session_id:
+                        # The request's session is closed by now, so record the exchange in a new one
+                        created_at = await write_in_session(
+                            chatbot.save_chat_message, user_id, session_id, message, "".join(chunks)
+                        )
+                        conversation.schedule_summary_update(session_id, chatbot.summarize)
+                        scoring.engine.record_chat(user_id, message, created_at)
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            release()
+
+    return _ReleasingStreamingResponse(
+        event_stream(),
+        release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.delete("/chat/sessions/{session_id}")
 async def delete_session(
     session_id: str,
+    db: AsyncDB = Depends(get_async_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Delete a chat session"""
-    success = chatbot.delete_chat_session(str(current_user.id), session_id)
+    success = await db.write(chatbot.delete_chat_session, current_user.id, session_id)
     return {"status": "success" if success else "failed"}
 
+@app.get("/api/admission")
+def get_admission_stats():
+    """Model admission: slots in use, queue depth, wait times and rejections"""
+    return admission.controller.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request, pipeline, model, database, cache and queue metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/signup/me", response_model=schemas.User)
 def get_current_user_info(current_user: models.User = Depends(auth.get_current_user)):
     return current_user
@@ -0,0 +1,347 @@
+"""
+In-process metrics in the Prometheus text format, plus per-request trace logs
+
+Recording is a lock and a few additions, cheap enough to leave on in production.
+Counters and histograms are recorded as events happen; gauges for state owned by
+other modules (cache sizes, queue depths) are read through callbacks at scrape time.
+"""
+import bisect
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Fraction of requests that print a JSON trace line (1 = every request, 0 = off)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# Requests slower than this are always traced, whatever the sample rate
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+
+# Default buckets in seconds, from 1 ms to 60 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, with sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+class Callback:
+    """
+    Gauge or counter whose values are read from another module at scrape time
+    func returns {label values tuple: value}, or a single number when there are no labels
+    """
+
+    def __init__(self, name: str, help: str, func: Callable, labels: Iterable[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.func()
+        except Exception as e:
+            print(f"Warning: Metric {self.name} failed: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.labels, key if isinstance(key, tuple) else (key,))} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+_registry: Dict[str, object] = {}
+_registry_lock = threading.Lock()
+
+def _register(metric):
+    with _registry_lock:
+        if metric.name in _registry:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        _registry[metric.name] = metric
+    return metric
+
+def counter(name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+    return _register(Counter(name, help, labels))
+
+def histogram(name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))
+
+def callback(name: str, help: str, func: Callable, labels: Iterable[str] = (), kind: str = "gauge") -> Callback:
+    return _register(Callback(name, help, func, labels, kind))
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+# Metrics shared across modules
+http_request_seconds = histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+pipeline_stage_seconds = histogram(
+    "chat_pipeline_stage_seconds", "Latency of each chat pipeline stage", ("stage",)
+)
+model_call_seconds = histogram(
+    "model_call_duration_seconds", "Latency of individual model calls", ("stage", "outcome")
+)
+model_tokens = counter(
+    "model_tokens_total", "Estimated tokens sent to and received from the model", ("stage", "direction")
+)
+db_query_seconds = histogram(
+    "db_query_duration_seconds", "Database statement latency", ("operation",)
+)
+password_hash_seconds = histogram(
+    "password_hash_duration_seconds", "PBKDF2 compute time per hash or verification", ("operation",)
+)
+explanation_cache_requests = counter(
+    "explanation_cache_requests_total", "Explanation reads by outcome", ("result",)
+)
+
+# Per-request trace, shared by everything running for the request (including threadpool work)
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+
+class Trace:
+    """Timings collected while serving one request"""
+
+    def __init__(self, trace_id: str, method: str, path: str):
+        self.trace_id = trace_id
+        self.method = method
+        self.path = path
+        self.route = path
+        self.status = 0
+        self.stages: Dict[str, float] = {}
+        self.model_calls = 0
+        self.tokens = 0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        # Request-specific facts added by handlers, e.g. the chat route decision
+        self.attributes: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def add_db_query(self, seconds: float):
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+    def add_model_call(self, tokens: int):
+        with self._lock:
+            self.model_calls += 1
+            self.tokens += tokens
+
+    def set_attributes(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def to_dict(self, duration: float) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "route": self.route,
+            "status": self.status,
+            "duration_ms": round(duration * 1000, 1),
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+            "model_calls": self.model_calls,
+            "tokens": self.tokens,
+            "db_queries": self.db_queries,
+            "db_ms": round(self.db_seconds * 1000, 1),
+            **({"attributes": self.attributes} if self.attributes else {}),
+        }
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def record_stages(timings: Dict[str, float]):
+    """Record pipeline stage latencies, from a PipelineResult's timings"""
+    trace = _current_trace.get()
+    for stage, seconds in timings.items():
+        pipeline_stage_seconds.observe(seconds, stage=stage)
+        if trace is not None:
+            trace.stages[stage] = seconds
+
+def record_model_call(stage: str, outcome: str, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0):
+    model_call_seconds.observe(seconds, stage=stage, outcome=outcome)
+    if prompt_tokens:
+        model_tokens.inc(prompt_tokens, stage=stage, direction="prompt")
+    if completion_tokens:
+        model_tokens.inc(completion_tokens, stage=stage, direction="completion")
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_model_call(prompt_tokens + completion_tokens)
+
+def record_db_query(operation: str, seconds: float):
+    db_query_seconds.observe(seconds, operation=operation)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_db_query(seconds)
+
+def instrument_engine(engine):
+    """Time every statement run on a SQLAlchemy engine"""
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if starts:
+            operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+            if operation not in ("select", "insert", "update", "delete"):
+                operation = "other"
+            record_db_query(operation, time.perf_counter() - starts.pop())
+
+    def failed(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    event.listen(engine, "handle_error", failed)
+
+# Full path templates of included routers' routes, by id(route)
+_prefixed_templates: Dict[int, str] = {}
+
+def register_router(router, prefix: str):
+    """
+    Record the full path of each route in a router included with a prefix
+    Routes of included routers report their path without the prefix
+    """
+    for route in router.routes:
+        path = getattr(route, "path", None)
+        if path is not None:
+            _prefixed_templates[id(route)] = prefix + path
+
+def _route_template(scope) -> str:
+    """The matched route's path template; unmatched paths share one label to bound cardinality"""
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+    return _prefixed_templates.get(id(route), template)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency by route template and writing a trace line
+    Latency covers the whole response, including streamed bodies
+    """
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE, slow_ms: float = TRACE_SLOW_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        trace_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        trace = Trace(trace_id, scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", trace_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except Exception:
+            trace.status = trace.status or 500
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            trace.route = _route_template(scope)
+            http_request_seconds.observe(duration, method=trace.method, route=trace.route, status=trace.status)
+            _current_trace.reset(token)
+            if duration * 1000 >= self.slow_ms or (self.sample_rate and random.random() < self.sample_rate):
+                print(json.dumps({"trace": trace.to_dict(duration)}))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Text, DateTime, Boolean, Date
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Text, DateTime, Boolean, Date, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -30,19 +30,45 @@ class LearningProfile(Base):
     # Relationship with User
     user = relationship("User", back_populates="learning_profile")
 
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+    __table_args__ = (
+        # History lists a user's sessions, most recently active first
+        Index("ix_chat_sessions_user_updated", "user_id", "updated_at"),
+    )
+    
+    id = Column(String, primary_key=True)  # UUID
+    user_id = Column(Integer, ForeignKey("users.id"))
+    title = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    summary = Column(Text, nullable=True)  # Rolling summary of turns older than the context window
+    summarized_through_id = Column(Integer, default=0)  # Last message id folded into the summary
+    
+    # Relationships
+    user = relationship("User", backref="chat_sessions")
+    messages = relationship("ChatMessage", back_populates="session")
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_user_created", "user_id", "created_at"),
+        # Messages of a session are paged by id
+        Index("ix_chat_messages_session_id", "session_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=True)
     content = Column(Text)
     response = Column(Text)
     planning_analysis = Column(Text)  # Store Planning Agent's analysis
     final_analysis = Column(Text)  # Store Analysis Agent's report
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    # Relationship with User
+    # Relationships
     user = relationship("User", back_populates="chat_messages")
+    session = relationship("ChatSession", back_populates="messages")
 
 class Subject(Base):
     __tablename__ = "subjects"
@@ -74,6 +100,10 @@ class Tutorial(Base):
 
 class UserTutorialHistory(Base):
     __tablename__ = "user_tutorial_history"
+    __table_args__ = (
+        # Recently viewed: the latest view of each tutorial for a user
+        Index("ix_tutorial_history_user_tutorial_viewed", "user_id", "tutorial_id", "viewed_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -86,6 +116,12 @@ class UserTutorialHistory(Base):
 
 class TimeSpentRecord(Base):
     __tablename__ = "time_spent_records"
+    __table_args__ = (
+        # One daily rollup per user, the target of the batched upserts
+        Index("ux_time_spent_user_date", "user_id", "date", unique=True),
+        # Covers the weekly report, which reads only the seconds for a range of days
+        Index("ix_time_spent_user_date_seconds", "user_id", "date", "total_seconds"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -93,4 +129,23 @@ class TimeSpentRecord(Base):
     total_seconds = Column(Integer, default=0)
     
     # Relationship with User
-    user = relationship("User", backref="time_spent_records") 
\ No newline at end of file
+    user = relationship("User", backref="time_spent_records") 
+
+class ExplanationCache(Base):
+    __tablename__ = "explanation_cache"
+    
+    subcategory = Column(String, primary_key=True)
+    explanation = Column(Text)
+    etag = Column(String)  # Hash of the explanation, for conditional GETs
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow, index=True)  # For LRU eviction
+
+class FlashcardDeck(Base):
+    __tablename__ = "flashcard_decks"
+    
+    # One deck per subcategory and profile bucket; a new version replaces decks from older prompts
+    subcategory = Column(String, primary_key=True)
+    preamble_id = Column(String, primary_key=True)
+    version = Column(Integer, primary_key=True)
+    cards = Column(Text)  # JSON list of {"front", "back"}
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,86 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+StageFunc = Callable[[Dict[str, Any]], Union[Any, Awaitable[Any]]]
+
+class Stage:
+    """A named step in a pipeline that runs once all of its dependencies have finished"""
+
+    def __init__(self, name: str, func: StageFunc, depends_on: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+class PipelineResult:
+    """Outputs and wall-clock latency (seconds) of each stage that ran"""
+
+    def __init__(self, outputs: Dict[str, Any], timings: Dict[str, float]):
+        self.outputs = outputs
+        self.timings = timings
+
+class Pipeline:
+    """
+    Runs stages as a DAG: each stage starts as soon as its dependencies finish,
+    so stages that don't depend on each other run concurrently
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage: {stage.name}")
+            self.stages[stage.name] = stage
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order = []
+        state = {}  # name -> "visiting" | "done"
+
+        def visit(name: str):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in pipeline at stage: {name}")
+            state[name] = "visiting"
+            for dependency in self.stages[name].depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {name} depends on unknown stage: {dependency}")
+                visit(dependency)
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    async def run(self, on_stage_start: Optional[Callable[[str], None]] = None) -> PipelineResult:
+        """Run every stage and return their outputs; the first failure cancels the rest"""
+        outputs: Dict[str, Any] = {}
+        timings: Dict[str, float] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage):
+            if stage.depends_on:
+                await asyncio.gather(*(tasks[name] for name in stage.depends_on))
+            if on_stage_start:
+                on_stage_start(stage.name)
+            start = time.perf_counter()
+            output = stage.func(outputs)
+            if inspect.isawaitable(output):
+                output = await output
+            timings[stage.name] = time.perf_counter() - start
+            outputs[stage.name] = output
+
+        # Dependencies are scheduled first, so tasks[name] always exists when awaited
+        for name in self.order:
+            tasks[name] = asyncio.ensure_future(run_stage(self.stages[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return PipelineResult(outputs, timings)
@@ -0,0 +1,43 @@
+import os
+from typing import Optional
+from sqlalchemy.orm import Session
+from chatbot import UserProfile
+from ttl_cache import TTLCache
+import models
+
+# Learning profiles by user id; the profile handlers invalidate on change,
+# and the TTL bounds staleness across workers
+_profile_cache = TTLCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "300"))
+)
+
+# Cached for users without a profile, so they don't query on every request either
+_NO_PROFILE = object()
+
+def get_profile(db: Session, user_id: int) -> Optional[models.LearningProfile]:
+    return db.query(models.LearningProfile).filter(
+        models.LearningProfile.user_id == user_id
+    ).first()
+
+def load_user_profile(db: Session, user_id: int) -> Optional[UserProfile]:
+    """The user's learning profile as a chatbot UserProfile, from the cache when possible"""
+    cached = _profile_cache.get(user_id)
+    if cached is not None:
+        return None if cached is _NO_PROFILE else cached
+
+    profile = get_profile(db, user_id)
+    user_profile = None
+    if profile:
+        user_profile = UserProfile(
+            verbal_score=profile.verbal_score,
+            non_verbal_score=profile.non_verbal_score,
+            self_assessment=profile.self_assessment,
+            age=profile.age
+        )
+    _profile_cache.set(user_id, user_profile if user_profile else _NO_PROFILE)
+    return user_profile
+
+def invalidate_profile(user_id: int):
+    """Drop a cached profile; call whenever a user's learning profile changes"""
+    _profile_cache.pop(user_id)
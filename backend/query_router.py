@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+import metrics
+
+# Pipelines a query can be routed to: the final answer alone, planning then the
+# answer, or the full planning -> analysis -> answer chain
+DIRECT = "direct"
+LIGHT = "light"
+FULL = "full"
+
+# Agent stages each route runs before the final answer
+ROUTE_STAGES = {
+    DIRECT: (),
+    LIGHT: ("planning",),
+    FULL: ("planning", "analysis"),
+}
+
+# QUERY_ROUTER_ENABLED=0 sends every query through the full chain
+ENABLED = os.getenv("QUERY_ROUTER_ENABLED", "1") != "0"
+
+# Longest query (in words) answered directly, and longest routed to the light pipeline
+DIRECT_MAX_WORDS = int(os.getenv("QUERY_ROUTER_DIRECT_MAX_WORDS", "12"))
+LIGHT_MAX_WORDS = int(os.getenv("QUERY_ROUTER_LIGHT_MAX_WORDS", "40"))
+
+# Reasoning signals that make a query worth the full chain
+FULL_MIN_SIGNALS = int(os.getenv("QUERY_ROUTER_FULL_MIN_SIGNALS", "2"))
+
+# Decisions are added to the request trace (logged when sampled); QUERY_ROUTER_LOG=1
+# also prints one JSON line per decision, for every request
+LOG_DECISIONS = os.getenv("QUERY_ROUTER_LOG", "0") == "1"
+
+# Weight of the newest observation in the running stage latency averages
+LATENCY_SMOOTHING = 0.1
+
+_SMALL_TALK = re.compile(
+    r"^(?:hi|hello|hey|thanks?|thank you(?: so much| very much)?|thx|ty|ok(?:ay)?|cool|great|nice|"
+    r"got it|i see|sure|yes|no|yep|nope|bye|goodbye|good (?:morning|afternoon|evening|night))"
+    r"(?:[\s,]+(?:so much|a lot|again|then|now|everyone|there))*[\s!.?:)]*$",
+    re.IGNORECASE
+)
+_LOOKUP = re.compile(
+    r"^(?:what(?:'s| is| are| was| were| does .+ mean)|define|definition of|meaning of|"
+    r"who (?:is|was|were)|when (?:is|was|did)|where (?:is|was)|what does)\b",
+    re.IGNORECASE
+)
+# The student describing their own attempt or confusion, which is what the planning
+# and analysis agents are for
+_OWN_ATTEMPT = re.compile(
+    r"\b(?:i (?:got|tried|think|thought|did|wrote|calculated|keep getting)|my (?:answer|solution|work|attempt)|"
+    r"(?:is|was) (?:this|that|it) (?:right|correct|wrong)|wrong|mistake|stuck|confus\w*|"
+    r"(?:don'?t|do not|can'?t|cannot) (?:understand|get|figure)|check my)\b",
+    re.IGNORECASE
+)
+_REASONING = re.compile(
+    r"\b(?:why|how|explain|solve|prove|derive|compare|differen\w*|step|steps|calculate|compute|"
+    r"simplify|show|example|examples|practice)\b",
+    re.IGNORECASE
+)
+_MATH = re.compile(r"\d\s*[-+*/^=<>]\s*\d|[a-z]\s*[=^]\s*\w|\d+\s*%", re.IGNORECASE)
+
+class RouteDecision:
+    __slots__ = ("route", "reason", "words", "signals")
+
+    def __init__(self, route: str, reason: str, words: int, signals: List[str]):
+        self.route = route
+        self.reason = reason
+        self.words = words
+        self.signals = signals
+
+    @property
+    def skipped(self) -> List[str]:
+        """Agent stages this route leaves out"""
+        return [stage for stage in ROUTE_STAGES[FULL] if stage not in ROUTE_STAGES[self.route]]
+
+def reasoning_signals(query: str, words: int) -> List[str]:
+    """Cheap features suggesting the query needs planning and analysis"""
+    signals = []
+    if _OWN_ATTEMPT.search(query):
+        signals.append("own_attempt")
+    if _REASONING.search(query):
+        signals.append("reasoning")
+    if _MATH.search(query):
+        signals.append("math")
+    if query.count("?") > 1 or len(re.findall(r"[.!?]\s+\S", query)) > 1:
+        signals.append("multi_part")
+    if words > LIGHT_MAX_WORDS:
+        signals.append("long")
+    return signals
+
+def classify(query: str, has_image: bool = False) -> RouteDecision:
+    """Pick the pipeline for a query from its wording alone; no model call"""
+    text = query.strip()
+    words = len(text.split())
+    if not ENABLED:
+        return RouteDecision(FULL, "disabled", words, [])
+    if has_image:
+        # The vision output is only worked into the answer through the agents
+        return RouteDecision(FULL, "image", words, [])
+    if not text or _SMALL_TALK.match(text):
+        return RouteDecision(DIRECT, "small_talk", words, [])
+
+    signals = reasoning_signals(text, words)
+    if "own_attempt" in signals:
+        return RouteDecision(FULL, "own_attempt", words, signals)
+    if len(signals) >= FULL_MIN_SIGNALS:
+        return RouteDecision(FULL, "signals", words, signals)
+    if not signals and words <= DIRECT_MAX_WORDS and _LOOKUP.match(text):
+        return RouteDecision(DIRECT, "lookup", words, signals)
+    if words <= LIGHT_MAX_WORDS:
+        return RouteDecision(LIGHT, "short", words, signals)
+    return RouteDecision(FULL, "long", words, signals)
+
+routed_queries = metrics.counter(
+    "query_routes_total", "Chat queries by the pipeline they were routed to", ("route", "reason")
+)
+saved_seconds = metrics.counter(
+    "query_route_saved_seconds_total", "Estimated agent-stage latency skipped by routing", ("route",)
+)
+
+class QueryRouter:
+    """
+    Routes queries to a pipeline and keeps score of what that saves
+    Savings are estimated from running averages of each agent stage's latency,
+    measured on the queries whose stage called the model (not served from the stage cache)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stage_seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {DIRECT: 0, LIGHT: 0, FULL: 0}
+        self.saved_seconds = 0.0
+
+    def route(self, query: str, has_image: bool = False) -> RouteDecision:
+        return classify(query, has_image)
+
+    def estimated_savings(self, decision: RouteDecision) -> Optional[float]:
+        """Seconds the skipped stages usually take, or None before they have been measured"""
+        with self._lock:
+            averages = [self._stage_seconds.get(stage) for stage in decision.skipped]
+        if any(average is None for average in averages):
+            return None
+        return sum(averages)
+
+    def record(self, decision: RouteDecision, timings: Dict[str, float], cached_stages: Iterable[str] = ()):
+        """
+        Account for a routed query once its pipeline has run, from the PipelineResult's timings
+        cached_stages were answered from the stage cache, so their timings don't count
+        """
+        cached_stages = set(cached_stages)
+        with self._lock:
+            for stage in ROUTE_STAGES[FULL]:
+                if stage in timings and stage not in cached_stages:
+                    average = self._stage_seconds.get(stage)
+                    seconds = timings[stage]
+                    self._stage_seconds[stage] = (
+                        seconds if average is None else average + LATENCY_SMOOTHING * (seconds - average)
+                    )
+        saved = self.estimated_savings(decision)
+        with self._lock:
+            self.counts[decision.route] += 1
+            self.saved_seconds += saved or 0
+        routed_queries.inc(route=decision.route, reason=decision.reason)
+        if saved:
+            saved_seconds.inc(saved, route=decision.route)
+        saved_ms = round(saved * 1000, 1) if saved is not None else None
+        trace = metrics.current_trace()
+        if trace is not None:
+            # Logged with the request's trace line, at the trace sample rate
+            trace.set_attributes(route=decision.route, reason=decision.reason, saved_ms=saved_ms)
+        if LOG_DECISIONS:
+            print(json.dumps({"query_route": {
+                "trace_id": trace.trace_id if trace is not None else None,
+                "route": decision.route,
+                "reason": decision.reason,
+                "words": decision.words,
+                "signals": decision.signals,
+                "skipped": decision.skipped,
+                "saved_ms": saved_ms,
+            }}))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counts,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "stage_avg_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self._stage_seconds.items()},
+            }
+
+# Shared by the chat endpoints
+router = QueryRouter()
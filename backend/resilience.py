@@ -0,0 +1,345 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional
+from llm import LLMError, LLMProvider, Prompt
+import metrics
+
+# Deadline per stage in seconds, covering every attempt and retry delay
+STAGE_DEADLINES = {
+    stage: float(os.getenv(f"MODEL_DEADLINE_{stage.upper()}", default))
+    for stage, default in (
+        ("vision", "20"),
+        ("planning", "15"),
+        ("analysis", "15"),
+        ("final", "30"),
+        ("summary", "30"),
+        ("flashcards", "45"),
+    )
+}
+DEFAULT_DEADLINE = 30.0
+
+# Retries for transient failures, with full-jitter exponential backoff
+MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.getenv("MODEL_RETRY_BASE_DELAY", "0.25"))
+RETRY_MAX_DELAY = float(os.getenv("MODEL_RETRY_MAX_DELAY", "2"))
+
+# Consecutive failures that open the circuit, and how long it stays open before a trial call
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("MODEL_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("MODEL_BREAKER_RESET", "30"))
+
+# A hedge is sent when the first request is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.getenv("MODEL_HEDGE_PERCENTILE", "0.95"))
+# Fixed hedge delay in seconds; when unset it follows the percentile above
+HEDGE_DELAY = os.getenv("MODEL_HEDGE_DELAY")
+# Delay used until enough latencies have been seen, and the floor for adaptive delays
+HEDGE_DEFAULT_DELAY = 2.0
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MIN_SAMPLES = 20
+
+# google.api_core errors worth retrying, matched by name so the Gemini SDK stays optional
+TRANSIENT_ERROR_NAMES = {
+    "ServiceUnavailable", "DeadlineExceeded", "ResourceExhausted", "InternalServerError",
+    "TooManyRequests", "GatewayTimeout", "BadGateway", "Aborted",
+}
+
+class ModelUnavailable(LLMError):
+    """The model could not answer in time; retry_after hints when to try again"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def estimate_tokens(prompt: Prompt) -> int:
+    """Rough token count of the text in a prompt (about four characters per token)"""
+    text = prompt if isinstance(prompt, str) else "".join(p for p in prompt if isinstance(p, str))
+    return (len(text) + 3) // 4
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, ModelUnavailable):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, LLMError)):
+        return True
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated upstream failures: opens after `failure_threshold`
+    consecutive failures, then lets one trial call through every `reset_timeout` seconds
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # When the current half-open trial call started; a trial that never reports back expires
+        self._trial_started: Optional[float] = None
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        now = self.clock()
+        if state == "half_open" and (self._trial_started is None or now - self._trial_started >= self.reset_timeout):
+            self._trial_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_started is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            # A failed trial restarts the open period
+            self.opened_at = self.clock()
+        self._trial_started = None
+
+    def reset(self):
+        self.record_success()
+
+class ModelCaller:
+    """Calls a provider with per-stage deadlines, jittered retries, a shared circuit breaker and hedging"""
+
+    def __init__(
+        self,
+        breaker: Optional[CircuitBreaker] = None,
+        deadlines: Optional[Dict[str, float]] = None,
+        max_retries: int = MAX_RETRIES,
+        hedge_delay: Optional[float] = float(HEDGE_DELAY) if HEDGE_DELAY else None
+    ):
+        self.breaker = breaker or CircuitBreaker()
+        self.deadlines = deadlines or STAGE_DEADLINES
+        self.max_retries = max_retries
+        self.hedge_delay = hedge_delay
+        self._latencies: Dict[str, Deque[float]] = {}
+        self.counts: Dict[str, int] = {"calls": 0, "retries": 0, "timeouts": 0, "rejected": 0, "hedges": 0, "hedge_wins": 0}
+
+    def _deadline(self, stage: str) -> float:
+        return asyncio.get_running_loop().time() + self.deadlines.get(stage, DEFAULT_DEADLINE)
+
+    def _remaining(self, deadline: float) -> float:
+        return deadline - asyncio.get_running_loop().time()
+
+    def _check_breaker(self, stage: str):
+        if not self.breaker.allow():
+            self.counts["rejected"] += 1
+            raise ModelUnavailable(
+                f"Model unavailable for {stage} (circuit open)",
+                retry_after=max(1.0, self.breaker.retry_after())
+            )
+
+    def _record_latency(self, stage: str, seconds: float):
+        self._latencies.setdefault(stage, deque(maxlen=200)).append(seconds)
+
+    def hedge_after(self, stage: str) -> float:
+        """How long to wait on the first request before sending a hedge"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        latencies = self._latencies.get(stage)
+        if not latencies or len(latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(latencies)
+        return max(HEDGE_MIN_DELAY, ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))])
+
+    def _record_failure(
+        self,
+        stage: str,
+        error: Exception,
+        elapsed: float,
+        prompt_tokens: int,
+        completion_tokens: int = 0
+    ) -> Exception:
+        """Account a failed attempt with the breaker and metrics; returns the error to surface"""
+        outcome = "error"
+        if isinstance(error, asyncio.TimeoutError):
+            self.counts["timeouts"] += 1
+            outcome = "timeout"
+            error = ModelUnavailable(f"{stage} stage timed out")
+        if is_transient(error) or isinstance(error, ModelUnavailable):
+            self.breaker.record_failure()
+        else:
+            # The upstream answered, it just rejected this request
+            self.breaker.record_success()
+        metrics.record_model_call(stage, outcome, elapsed, prompt_tokens, completion_tokens)
+        return error
+
+    def _unavailable(self, stage: str, error: BaseException) -> ModelUnavailable:
+        """A transient upstream error that outlasted the retries, as a ModelUnavailable (503)"""
+        return ModelUnavailable(
+            f"{stage} model unavailable ({type(error).__name__})",
+            retry_after=max(1.0, self.breaker.retry_after())
+        )
+
+    async def _backoff(self, stage: str, attempt: int, deadline: float, error: BaseException):
+        """
+        Sleep before the next attempt, or raise when out of retries or time
+        Transient errors are raised as ModelUnavailable, whatever SDK exception they came as
+        """
+        if not is_transient(error):
+            raise error
+        if attempt >= self.max_retries:
+            raise self._unavailable(stage, error) from error
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if delay >= self._remaining(deadline):
+            raise self._unavailable(stage, error) from error
+        self.counts["retries"] += 1
+        print(f"Warning: {stage} model call failed ({error!r}), retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def generate(
+        self,
+        provider: LLMProvider,
+        prompt: Prompt,
+        stage: str,
+        deadline: Optional[float] = None,
+        json_output: bool = False
+    ) -> str:
+        """
+        Generate with retries for transient errors, all within the stage deadline
+        With json_output the provider is asked for a JSON response
+        """
+        deadline = deadline or self._deadline(stage)
+        attempt = 0
+        while True:
+            self._check_breaker(stage)
+            remaining = self._remaining(deadline)
+            if remaining <= 0:
+                self.counts["timeouts"] += 1
+                raise ModelUnavailable(f"{stage} stage ran out of time")
+            self.counts["calls"] += 1
+            start = time.perf_counter()
+            try:
+                call = provider.generate_json(prompt) if json_output else provider.generate(prompt)
+                output = await asyncio.wait_for(call, remaining)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                e = self._record_failure(stage, e, time.perf_counter() - start, estimate_tokens(prompt))
+                await self._backoff(stage, attempt, deadline, e)
+                attempt += 1
+                continue
+            elapsed = time.perf_counter() - start
+            self.breaker.record_success()
+            self._record_latency(stage, elapsed)
+            metrics.record_model_call(stage, "ok", elapsed, estimate_tokens(prompt), estimate_tokens(output or ""))
+            return output
+
+    async def generate_hedged(self, provider: LLMProvider, prompt: Prompt, stage: str) -> str:
+        """
+        Like generate, but if the first request is slower than usual a second identical
+        request is sent and whichever answers first wins; the other is cancelled
+        """
+        deadline = self._deadline(stage)
+        first = asyncio.ensure_future(self.generate(provider, prompt, stage, deadline))
+        pending = {first}
+        error: Optional[BaseException] = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=min(self.hedge_after(stage), max(0.0, self._remaining(deadline))))
+            # Don't add load to an upstream that is already failing
+            if done or self.breaker.state != "closed":
+                return await first
+
+            self.counts["hedges"] += 1
+            hedge = asyncio.ensure_future(self.generate(provider, prompt, stage, deadline))
+            pending = {first, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counts["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(
+        self,
+        provider: LLMProvider,
+        prompt: Prompt,
+        stage: str
+    ) -> AsyncIterator[str]:
+        """
+        Stream with the stage deadline applied to the whole response
+        Failures before the first chunk are retried; once output has been sent they can't be
+        """
+        deadline = self._deadline(stage)
+        attempt = 0
+        while True:
+            self._check_breaker(stage)
+            self.counts["calls"] += 1
+            start = time.perf_counter()
+            chunks = provider.stream(prompt).__aiter__()
+            sent = False
+            completion_tokens = 0
+            try:
+                while True:
+                    remaining = self._remaining(deadline)
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        break
+                    if not sent:
+                        sent = True
+                        # Time to first token, kept apart from the full-response latencies hedging uses
+                        self._record_latency(f"{stage}.ttft", time.perf_counter() - start)
+                    completion_tokens += estimate_tokens(chunk)
+                    yield chunk
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                e = self._record_failure(stage, e, time.perf_counter() - start, estimate_tokens(prompt), completion_tokens)
+                if sent:
+                    raise e
+                await self._backoff(stage, attempt, deadline, e)
+                attempt += 1
+                continue
+            finally:
+                aclose = getattr(chunks, "aclose", None)
+                if aclose:
+                    await aclose()
+            self.breaker.record_success()
+            metrics.record_model_call(
+                stage, "ok", time.perf_counter() - start, estimate_tokens(prompt), completion_tokens
+            )
+            return
+
+    def stats(self) -> dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "breaker_opened": self.breaker.times_opened,
+            **self.counts,
+            "hedge_after_ms": {stage: round(self.hedge_after(stage) * 1000) for stage in self._latencies},
+        }
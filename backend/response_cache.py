@@ -0,0 +1,167 @@
+import hashlib
+import re
+import threading
+from collections import Counter
+from typing import Dict, FrozenSet, Optional, Set, Tuple
+from ttl_cache import TTLCache
+
+# Numbers and math symbols must match exactly for a near-duplicate hit,
+# so "what is 2+3" never reuses the answer to "what is 2+4"
+_EXACT_TOKENS = re.compile(r"\d+(?:\.\d+)?|[+\-*/^=<>%()]")
+
+# Words a near-duplicate may add, drop or reorder; every other word must match, so
+# swapping "positive" for "negative" in a long query is never a hit. Negations are
+# deliberately not in this list.
+_FILLER_WORDS = frozenset("""
+a an the and or but so of to in on at for with by from about as into than then
+is are was were be been being am do does did can could would should will shall may might must
+i me my we our you your it its this that these those there here
+what whats which who whom how please pls just really also
+""".split())
+_WORDS = re.compile(r"[a-z]+")
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.rstrip("?!. ")
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _exact_signature(text: str) -> Tuple[Tuple[str, ...], FrozenSet[str]]:
+    """Numbers and symbols in order, plus the set of content words; both must match for a fuzzy hit"""
+    content = frozenset(word for word in _WORDS.findall(text.replace("'", "")) if word not in _FILLER_WORDS)
+    return tuple(_EXACT_TOKENS.findall(text)), content
+
+class ResponseCache:
+    """
+    Cache of final chat responses keyed on the normalized query and a profile bucket
+    Exact matches use a hash lookup; near-duplicates are found through a trigram
+    index and accepted above a Jaccard similarity threshold
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: Optional[float] = 86400, similarity: float = 0.85):
+        self.similarity = similarity
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._unindex)
+        # key -> (bucket, trigrams, exact signature)
+        self._features: Dict[str, tuple] = {}
+        # (bucket, trigram) -> keys containing it
+        self._index: Dict[Tuple[str, str], Set[str]] = {}
+        self._lock = threading.RLock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(bucket: str, normalized: str) -> str:
+        return hashlib.sha256(f"{bucket}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, bucket: str) -> Optional[str]:
+        """Return a cached response for this query or a near-duplicate of it"""
+        normalized = normalize_query(query)
+        with self._lock:
+            response = self._entries.get(self._key(bucket, normalized))
+            if response is not None:
+                self.exact_hits += 1
+                return response
+
+            key = self._most_similar(bucket, normalized)
+            if key is not None:
+                response = self._entries.get(key)
+                if response is not None:
+                    self.similar_hits += 1
+                    return response
+            self.misses += 1
+            return None
+
+    def set(self, query: str, bucket: str, response: str):
+        """Cache a response for this query and profile bucket"""
+        if self._entries.maxsize <= 0:
+            # Caching disabled: the entry is never stored, so it must not be indexed either
+            return
+        normalized = normalize_query(query)
+        key = self._key(bucket, normalized)
+        with self._lock:
+            if key not in self._features:
+                trigrams = _trigrams(normalized)
+                self._features[key] = (bucket, trigrams, _exact_signature(normalized))
+                for trigram in trigrams:
+                    self._index.setdefault((bucket, trigram), set()).add(key)
+            self._entries.set(key, response)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _most_similar(self, bucket: str, normalized: str) -> Optional[str]:
+        if self.similarity >= 1:
+            return None
+        trigrams = _trigrams(normalized)
+        signature = _exact_signature(normalized)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._index.get((bucket, trigram), ()))
+
+        best_key, best_score = None, self.similarity
+        for key, common in shared.items():
+            _, other, other_signature = self._features[key]
+            score = common / (len(trigrams) + len(other) - common)
+            if score >= best_score and other_signature == signature:
+                best_key, best_score = key, score
+        return best_key
+
+    def _unindex(self, key: str, _response: str):
+        bucket, trigrams, _ = self._features.pop(key, (None, (), ()))
+        for trigram in trigrams:
+            keys = self._index.get((bucket, trigram))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(bucket, trigram)]
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and current size"""
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        hits = self.exact_hits + self.similar_hits
+        return {
+            "size": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self._entries.evictions,
+            "expirations": self._entries.expirations,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+class StageCache:
+    """
+    Cache of profile-independent agent outputs (planning, analysis)
+    Entries are keyed on the stage name and its fully formatted prompt, so editing a
+    prompt template stops matching old entries; invalidate() drops them explicitly
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = 86400):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations: Dict[str, int] = {}
+
+    def _key(self, stage: str, prompt: str) -> str:
+        generation = self._generations.get(stage, 0)
+        return hashlib.sha256(f"{stage}\0{generation}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, stage: str, prompt: str) -> Optional[str]:
+        return self._entries.get(self._key(stage, prompt))
+
+    def set(self, stage: str, prompt: str, output: str):
+        self._entries.set(self._key(stage, prompt), output)
+
+    def invalidate(self, stage: Optional[str] = None):
+        """Drop every entry, or only those of one stage (e.g. after changing its template)"""
+        if stage is None:
+            self._entries.clear()
+        else:
+            # Old keys become unreachable and age out of the LRU
+            self._generations[stage] = self._generations.get(stage, 0) + 1
+
+    def stats(self) -> Dict[str, float]:
+        return self._entries.stats()
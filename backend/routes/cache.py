@@ -1,45 +1,113 @@
-from fastapi import APIRouter, HTTPException, Body
-import json
-from typing import Dict, Optional
 import os
+from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from typing import Dict, Optional
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from database import engine, get_db, get_async_db, write_in_session, AsyncDB, SessionLocal
+from http_cache import etag_matches, not_modified
+from routes.subjects import catalog
+from singleflight import SingleFlight
+import admission
+import chatbot
+import explanation_store
+import metrics
+import models
 
 router = APIRouter()
 
-# In-memory cache
-_cache: Dict[str, str] = {}
-
-# Cache file path
+# Legacy cache file, imported into the explanation_cache table on first start
 CACHE_FILE = "subject_cache.json"
 
+# Explanations larger than this are rejected
+MAX_EXPLANATION_BYTES = 256 * 1024
+
+# Explanations older than this are served stale while a fresh one is generated
+EXPLANATION_MAX_AGE = timedelta(seconds=float(os.getenv("EXPLANATION_MAX_AGE", str(7 * 24 * 3600))))
+
+# Same question the resources page used to send to /chat on a cache miss
+EXPLANATION_PROMPT = "I don't understand {subcategory}. Can you explain it to me?"
+
+# At most one generation per subcategory at a time
+_generations = SingleFlight()
+
 class ExplanationBody(BaseModel):
     explanation: str
 
 def load_cache():
-    """Load cache from file if it exists"""
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
-            global _cache
-            _cache = json.load(f)
+    """Create the cache table and import the legacy JSON file if the table is empty"""
+    models.ExplanationCache.__table__.create(bind=engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        if db.query(models.ExplanationCache.subcategory).first() is None:
+            explanation_store.import_json_cache(db, CACHE_FILE)
+    finally:
+        db.close()
 
-def save_cache():
-    """Save cache to file"""
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(_cache, f)
+async def _generate_and_store(subcategory: str, refresh: bool = False) -> str:
+    # One admission slot per generation, however many readers are waiting on it
+    async with admission.controller.admit():
+        # A refresh must not be answered by the chat caches, which may hold the stale text
+        explanation = await chatbot.get_chat_response(
+            EXPLANATION_PROMPT.format(subcategory=subcategory), refresh=refresh
+        )
+    await write_in_session(explanation_store.put_explanation, subcategory, explanation)
+    return explanation
+
+async def generate_explanation(subcategory: str, refresh: bool = False) -> str:
+    """
+    Generate and store an explanation; concurrent callers share one generation
+    With refresh, cached chat answers are not reused, so a stored explanation is really replaced
+    """
+    return await _generations.do(subcategory, lambda: _generate_and_store(subcategory, refresh))
 
 # Load cache on startup
 load_cache()
 
 @router.get("/explanation/{subcategory}")
-async def get_cached_explanation(subcategory: str) -> Dict[str, Optional[str]]:
-    """Get cached explanation for a subcategory"""
-    if subcategory in _cache:
-        return {"explanation": _cache[subcategory]}
-    return {"explanation": None}
+async def get_cached_explanation(
+    subcategory: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncDB = Depends(get_async_db)
+) -> Dict[str, Optional[str]]:
+    """
+    Get the explanation for a subcategory, generating it on a miss
+    Stale entries are served immediately while a refresh runs in the background
+    """
+    entry = await db.run(explanation_store.get_explanation, subcategory)
+    if entry is None:
+        # Only generate for topics in the catalog
+        if not catalog.has_subcategory(subcategory):
+            metrics.explanation_cache_requests.inc(result="unknown")
+            return {"explanation": None}
+        metrics.explanation_cache_requests.inc(result="miss")
+        try:
+            explanation = await generate_explanation(subcategory)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Explanation error: {e}")  # Log the error
+            raise HTTPException(status_code=502, detail="Failed to generate explanation")
+        response.headers["ETag"] = explanation_store.make_etag(explanation)
+        response.headers["Cache-Control"] = "no-cache"
+        return {"explanation": explanation}
+
+    stale = entry.updated_at is None or datetime.utcnow() - entry.updated_at > EXPLANATION_MAX_AGE
+    if stale:
+        _generations.start(subcategory, lambda: _generate_and_store(subcategory, refresh=True))
+    if etag_matches(if_none_match, entry.etag):
+        metrics.explanation_cache_requests.inc(result="not_modified")
+        return not_modified(entry.etag, "no-cache")
+    metrics.explanation_cache_requests.inc(result="stale" if stale else "hit")
+    response.headers["ETag"] = entry.etag
+    response.headers["Cache-Control"] = "no-cache"
+    return {"explanation": entry.explanation}
 
 @router.post("/explanation/{subcategory}")
-async def cache_explanation(subcategory: str, body: ExplanationBody):
+def cache_explanation(subcategory: str, body: ExplanationBody, response: Response, db: Session = Depends(get_db)):
     """Cache explanation for a subcategory"""
-    _cache[subcategory] = body.explanation
-    save_cache()
-    return {"status": "success"} 
\ No newline at end of file
+    if len(body.explanation.encode("utf-8")) > MAX_EXPLANATION_BYTES:
+        raise HTTPException(status_code=413, detail="Explanation is too large")
+    response.headers["ETag"] = explanation_store.put_explanation(db, subcategory, body.explanation)
+    return {"status": "success"}
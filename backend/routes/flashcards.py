@@ -0,0 +1,76 @@
+import math
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from database import get_async_db, AsyncDB
+from llm import LLMError
+from routes.subjects import catalog
+import admission
+import auth
+import chatbot
+import flashcards
+import models
+import profiles
+import schemas
+
+router = APIRouter()
+
+def _topics(subcategory: str):
+    return [subject["name"] for subject in catalog.by_subcategory.get(subcategory, [])]
+
+async def _preamble_id(db: AsyncDB, user_id: int) -> str:
+    """The profile bucket a user's decks are written for"""
+    return chatbot.preamble_id(await db.run(profiles.load_user_profile, user_id))
+
+@router.post("/batch", response_model=schemas.FlashcardBatchResult)
+async def generate_decks(
+    body: schemas.FlashcardBatchRequest,
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Make sure decks exist for several subcategories, e.g. to prefetch a course
+    Generations run a few at a time; subcategories that already have a deck cost nothing
+    """
+    names = list(dict.fromkeys(body.subcategories))
+    if len(names) > flashcards.MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {flashcards.MAX_BATCH_SIZE} subcategories per batch")
+    # The batch counts as one request against the user's rate limit
+    admission.controller.check_rate(current_user.id)
+    preamble_id = await _preamble_id(db, current_user.id)
+    known = {name: _topics(name) for name in names if catalog.has_subcategory(name)}
+    results = await flashcards.generate_batch(known, preamble_id)
+    return {"results": {name: results.get(name, "unknown") for name in names}}
+
+@router.get("/{subcategory}", response_model=schemas.FlashcardDeck)
+async def get_deck(
+    subcategory: str,
+    count: Optional[int] = Query(None, ge=1, le=flashcards.DECK_SIZE),
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """The flashcard deck for a subcategory, generated in one model call the first time"""
+    if not catalog.has_subcategory(subcategory):
+        raise HTTPException(status_code=404, detail="Unknown subcategory")
+    preamble_id = await _preamble_id(db, current_user.id)
+    cards = await flashcards.cached_deck(subcategory, preamble_id)
+    if cards is None:
+        admission.controller.check_rate(current_user.id)
+        try:
+            cards = await flashcards.get_or_generate(subcategory, _topics(subcategory), preamble_id)
+        except HTTPException:
+            raise
+        except LLMError as e:
+            print(f"Flashcard error: {e}")  # Log the error
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The tutor is temporarily unavailable, please try again",
+                headers={"Retry-After": str(math.ceil(getattr(e, "retry_after", 1)))}
+            )
+        except Exception as e:
+            print(f"Flashcard error: {e}")  # Log the error
+            raise HTTPException(status_code=502, detail="Failed to generate flashcards")
+    return schemas.FlashcardDeck(
+        subcategory=subcategory,
+        version=flashcards.DECK_VERSION,
+        cards=cards[:count] if count else cards
+    )
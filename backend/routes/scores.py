@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+import auth
+import models
+import schemas
+import scoring
+
+router = APIRouter()
+
+@router.get("", response_model=schemas.SubjectCategoryScore)
+async def get_scores(current_user: models.User = Depends(auth.get_current_user)):
+    """The user's engagement in each subject category, 0-100, from precomputed values"""
+    return scoring.engine.scores(current_user.id)
@@ -0,0 +1,36 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, status
+from database import get_async_db, AsyncDB
+import auth
+import models
+import schemas
+import scoring
+import study_time
+
+router = APIRouter()
+
+@router.post("/heartbeat", status_code=status.HTTP_202_ACCEPTED)
+async def record_heartbeat(
+    heartbeat: schemas.StudyHeartbeat,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Credit time studied since the previous heartbeat
+    Buffered in memory and written in batches, so clients can report as often as they like
+    """
+    today = datetime.utcnow().date()
+    credited = study_time.buffer.add(current_user.id, heartbeat.seconds, today)
+    scoring.engine.record_study_time(current_user.id, credited, today)
+    return {"credited_seconds": credited}
+
+@router.get("/weekly", response_model=schemas.WeeklyTimeReport)
+async def get_weekly_report(
+    start: Optional[date] = Query(None, description="Any day of the week; defaults to the current week"),
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Study time for each day of a week, Monday first"""
+    week = study_time.week_start(start or datetime.utcnow().date())
+    pending = study_time.buffer.pending_for(current_user.id, week, week + timedelta(days=6))
+    return await db.run(study_time.get_weekly_report, current_user.id, week, pending)
@@ -1,30 +1,65 @@
-from fastapi import APIRouter, HTTPException
-import json
-from typing import List, Dict
+from fastapi import APIRouter, HTTPException, Header, Query, Response
+from typing import List, Optional
+from sqlalchemy.exc import SQLAlchemyError
+from catalog import SubjectCatalog
+from database import SessionLocal
+from http_cache import etag_matches, not_modified
+import models
 
 router = APIRouter()
 
-def load_subjects():
-    with open('subjects.json', 'r') as f:
-        data = json.load(f)
-        return data.get('subjects', [])
+def load_db_subjects() -> List[dict]:
+    """Subjects from the subjects table, included in search results"""
+    db = SessionLocal()
+    try:
+        return [
+            {
+                "id": subject.id,
+                "name": subject.name,
+                "category": subject.category,
+                "subcategory": subject.subcategory,
+                "description": subject.description,
+            }
+            for subject in db.query(models.Subject).all()
+        ]
+    except SQLAlchemyError as e:
+        print(f"Warning: Failed to load subjects table: {e}")
+        return []
+    finally:
+        db.close()
+
+# Loaded once; reloaded automatically when subjects.json changes
+catalog = SubjectCatalog('subjects.json', extra_subjects=load_db_subjects)
+
+# Browsers may reuse responses briefly, then revalidate with the ETag
+CACHE_CONTROL = "public, max-age=60"
 
 @router.get("/categories")
-def get_categories() -> List[str]:
-    subjects = load_subjects()
-    # Get unique categories
-    categories = list(set(subject['category'] for subject in subjects))
-    return sorted(categories)
+def get_categories(response: Response, if_none_match: Optional[str] = Header(None)) -> List[str]:
+    categories = catalog.get_categories()
+    if etag_matches(if_none_match, catalog.etag):
+        return not_modified(catalog.etag, CACHE_CONTROL)
+    response.headers["ETag"] = catalog.etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return categories
 
 @router.get("/subcategories/{category}")
-def get_subcategories(category: str) -> List[str]:
-    subjects = load_subjects()
-    # Get unique subcategories for the given category
-    subcategories = list(set(
-        subject['subcategory'] 
-        for subject in subjects 
-        if subject['category'] == category
-    ))
+def get_subcategories(category: str, response: Response, if_none_match: Optional[str] = Header(None)) -> List[str]:
+    subcategories = catalog.get_subcategories(category)
     if not subcategories:
         raise HTTPException(status_code=404, detail=f"No subcategories found for category: {category}")
-    return sorted(subcategories) 
\ No newline at end of file
+    if etag_matches(if_none_match, catalog.etag):
+        return not_modified(catalog.etag, CACHE_CONTROL)
+    response.headers["ETag"] = catalog.etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return subcategories
+
+@router.get("/search")
+def search_subjects(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """Ranked typeahead search across subject names, categories, subcategories and descriptions"""
+    total, results = catalog.search(q, limit, offset)
+    return {"query": q, "total": total, "limit": limit, "offset": offset, "results": results}
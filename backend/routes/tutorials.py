@@ -0,0 +1,62 @@
+import json
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from database import get_async_db, AsyncDB
+import auth
+import models
+import schemas
+import scoring
+import tutorial_views
+
+router = APIRouter()
+
+def get_tutorial(db: Session, tutorial_id: int) -> Tuple[Optional[schemas.Tutorial], Optional[Tuple[str, str]]]:
+    """A tutorial and its subject's (category, subcategory), if they exist"""
+    tutorial = db.get(models.Tutorial, tutorial_id)
+    if tutorial is None:
+        db.rollback()
+        return None, None
+    subject = db.query(models.Subject.category, models.Subject.subcategory).filter(
+        models.Subject.id == tutorial.subject_id
+    ).first()
+    try:
+        visual_aids = json.loads(tutorial.visual_aids) if tutorial.visual_aids else []
+    except ValueError:
+        visual_aids = []
+    result = schemas.Tutorial(
+        id=tutorial.id,
+        subject_id=tutorial.subject_id,
+        title=tutorial.title,
+        content=tutorial.content,
+        difficulty_level=tutorial.difficulty_level,
+        visual_aids=visual_aids,
+        created_at=tutorial.created_at,
+        last_viewed_at=tutorial.last_viewed_at
+    )
+    db.rollback()
+    return result, tuple(subject) if subject else None
+
+@router.get("/recent", response_model=List[schemas.RecentTutorial])
+async def get_recently_viewed(
+    limit: int = Query(min(10, tutorial_views.RECENT_PER_USER), ge=1, le=tutorial_views.RECENT_PER_USER),
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """The user's recently viewed tutorials, newest first, served from memory"""
+    return await tutorial_views.buffer.recently_viewed(db, current_user.id, limit)
+
+@router.get("/{tutorial_id}", response_model=schemas.Tutorial)
+async def view_tutorial(
+    tutorial_id: int,
+    db: AsyncDB = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Get a tutorial; the view is recorded write-behind, off the request path"""
+    tutorial, subject = await db.run(get_tutorial, tutorial_id)
+    if tutorial is None:
+        raise HTTPException(status_code=404, detail="Tutorial not found")
+    tutorial.last_viewed_at = tutorial_views.buffer.record(current_user.id, tutorial.id, tutorial.title)
+    if subject is not None:
+        scoring.engine.record_view(current_user.id, *subject, tutorial.last_viewed_at)
+    return tutorial
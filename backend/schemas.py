@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field
+from typing import Dict, Optional, List
 from datetime import datetime, date
 
 class UserBase(BaseModel):
@@ -48,6 +48,7 @@ class ChatMessageCreate(ChatMessageBase):
 class ChatMessageResponse(ChatMessageBase):
     id: int
     user_id: int
+    session_id: Optional[str] = None
     response: str
     planning_analysis: str
     final_analysis: str
@@ -56,6 +57,25 @@ class ChatMessageResponse(ChatMessageBase):
     class Config:
         from_attributes = True
 
+class ChatSession(BaseModel):
+    id: str
+    title: str
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class ChatHistory(BaseModel):
+    user_id: str
+    sessions: List[ChatSession]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= to get the next page
+
+class ChatMessagePage(BaseModel):
+    session_id: str
+    messages: List[ChatMessageResponse]  # Oldest first within the page
+    next_cursor: Optional[str] = None  # Pass as ?cursor= to get older messages
+
 class UserWithProfile(User):
     learning_profile: Optional[LearningProfile] = None
     chat_messages: List[ChatMessageResponse] = []
@@ -100,8 +120,13 @@ class UserTutorialHistory(BaseModel):
     class Config:
         from_attributes = True
 
+class RecentTutorial(BaseModel):
+    tutorial_id: int
+    title: str
+    viewed_at: datetime
+
 class TimeSpentRecord(BaseModel):
-    id: int
+    id: Optional[int] = None  # None for days with no stored rollup yet
     user_id: int
     date: date
     total_seconds: int
@@ -116,6 +141,25 @@ class WeeklyTimeReport(BaseModel):
     days: List[TimeSpentRecord]
     total_hours: float
 
+class StudyHeartbeat(BaseModel):
+    seconds: int = Field(..., ge=0)  # Seconds studied since the previous heartbeat
+
+class Flashcard(BaseModel):
+    front: str
+    back: str
+
+class FlashcardDeck(BaseModel):
+    subcategory: str
+    version: int
+    cards: List[Flashcard]
+
+class FlashcardBatchRequest(BaseModel):
+    subcategories: List[str]
+
+class FlashcardBatchResult(BaseModel):
+    # Per subcategory: "cached", "generated", "failed" or "unknown"
+    results: Dict[str, str]
+
 class SubjectCategoryScore(BaseModel):
     mathematics: float
     biology: float
@@ -0,0 +1,383 @@
+"""
+Per-user subject-category scores, kept up to date as activity arrives
+
+Each user has one row of decayed activity per category in a NumPy array. Chat
+messages, tutorial views and study time add to it as they happen; a periodic
+bulk pass rebuilds every row from the stored history with vectorized operations,
+correcting drift and restoring state after a restart. Reads apply the decay to
+a single row, so a dashboard load never scans history.
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from catalog import tokenize
+from database import SessionLocal
+import models
+import schemas
+import study_time
+import tutorial_views
+
+# Order of the columns, matching schemas.SubjectCategoryScore
+CATEGORIES = ("mathematics", "biology", "physics", "geometry", "chemistry")
+
+# Activity counts half as much after this many days
+HALF_LIFE_DAYS = float(os.getenv("SCORE_HALF_LIFE_DAYS", "14"))
+# Decayed activity at which a score reaches about 63 out of 100
+SCORE_SCALE = float(os.getenv("SCORE_SCALE", "20"))
+# How often scores are rebuilt from history, in seconds
+RECOMPUTE_INTERVAL = float(os.getenv("SCORE_RECOMPUTE_INTERVAL", str(6 * 3600)))
+
+# Activity added per event
+CHAT_WEIGHT = 1.0
+VIEW_WEIGHT = 2.0
+STUDY_MINUTE_WEIGHT = 0.1
+
+# Words that place a chat message in a category
+KEYWORDS = {
+    "mathematics": (
+        "math maths mathematics algebra arithmetic equation equations fraction fractions number numbers "
+        "integer integers multiply multiplication divide division addition subtraction percent percentage "
+        "ratio calculus derivative integral probability statistics mean median function functions "
+        "polynomial exponent exponents logarithm decimal decimals"
+    ),
+    "biology": (
+        "biology cell cells organism organisms plant plants animal animals dna gene genes evolution "
+        "photosynthesis ecosystem organ organs bacteria virus viruses protein proteins"
+    ),
+    "physics": (
+        "physics force forces motion velocity speed acceleration gravity energy momentum newton "
+        "electricity circuit circuits magnet magnetism wave waves light friction pressure"
+    ),
+    "geometry": (
+        "geometry triangle triangles angle angles circle circles area perimeter polygon polygons "
+        "rectangle volume shape shapes pythagoras pythagorean trigonometry sine cosine tangent radius diameter"
+    ),
+    "chemistry": (
+        "chemistry atom atoms molecule molecules element elements periodic reaction reactions acid acids "
+        "compound compounds bond bonds electron electrons ion ions chemical chemicals"
+    ),
+}
+_KEYWORD_INDEX = {
+    word: CATEGORIES.index(category)
+    for category, words in KEYWORDS.items()
+    for word in words.split()
+}
+
+# Catalog subcategories and categories that map onto a score category
+SUBJECT_CATEGORIES = {
+    "geometry": "geometry",
+    "analytic geometry": "geometry",
+    "trigonometry": "geometry",
+    "physics": "physics",
+    "chemistry": "chemistry",
+    "biology": "biology",
+    "mathematics": "mathematics",
+}
+
+_DECAY_RATE = np.log(2) / (HALF_LIFE_DAYS * 24 * 3600)
+
+def classify_text(text: Optional[str]) -> Optional[int]:
+    """The category column a chat message is about, or None if it matches no keywords"""
+    counts = [0] * len(CATEGORIES)
+    for token in tokenize(text):
+        column = _KEYWORD_INDEX.get(token)
+        if column is not None:
+            counts[column] += 1
+    best = max(counts)
+    return counts.index(best) if best else None
+
+def classify_subject(category: Optional[str], subcategory: Optional[str]) -> Optional[int]:
+    """The category column for a catalog subject, most specific name first"""
+    for name in (subcategory, category):
+        match = SUBJECT_CATEGORIES.get((name or "").lower())
+        if match:
+            return CATEGORIES.index(match)
+    return None
+
+def to_scores(activity: np.ndarray) -> np.ndarray:
+    """Map decayed activity onto 0-100, saturating for very active users"""
+    return 100.0 * (1.0 - np.exp(-activity / SCORE_SCALE))
+
+def _ages(times: List[datetime], now: datetime) -> np.ndarray:
+    """Seconds between each time and now, as a float array"""
+    if not times:
+        return np.zeros(0)
+    return (np.datetime64(now, "us") - np.array(times, dtype="datetime64[us]")) / np.timedelta64(1, "s")
+
+def _decay(ages: np.ndarray) -> np.ndarray:
+    return np.exp(-_DECAY_RATE * np.maximum(ages, 0.0))
+
+def _timestamp(moment: datetime) -> float:
+    """Unix time of a naive UTC datetime, as stored in the database"""
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+def study_reference(day: date) -> datetime:
+    """
+    When a day's study time counts as having happened: the start of the day
+    Both the bulk rebuild and live updates decay it from here, so they agree
+    """
+    return datetime.combine(day, datetime.min.time())
+
+def compute_all(db: Session, cutoff: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every user's decayed activity as of cutoff, from the stored history
+    Returns (user ids, activity matrix with one row per user)
+    """
+    chats = db.query(
+        models.ChatMessage.user_id, models.ChatMessage.content, models.ChatMessage.created_at
+    ).filter(models.ChatMessage.created_at < cutoff).all()
+    views = db.query(
+        models.UserTutorialHistory.user_id,
+        models.Subject.category,
+        models.Subject.subcategory,
+        models.UserTutorialHistory.viewed_at
+    ).join(
+        models.Tutorial, models.Tutorial.id == models.UserTutorialHistory.tutorial_id
+    ).join(
+        models.Subject, models.Subject.id == models.Tutorial.subject_id
+    ).filter(models.UserTutorialHistory.viewed_at < cutoff).all()
+    study = db.query(
+        models.TimeSpentRecord.user_id, models.TimeSpentRecord.date, models.TimeSpentRecord.total_seconds
+    ).filter(models.TimeSpentRecord.date <= cutoff.date()).all()
+    db.rollback()
+
+    # Categorise in Python (string work), then accumulate with array operations
+    chat_columns = np.array([classify_text(content) for _, content, _ in chats], dtype=float)
+    subject_columns: Dict[Tuple[str, str], Optional[int]] = {}
+    view_columns = np.array([
+        subject_columns.setdefault((category, subcategory), classify_subject(category, subcategory))
+        for _, category, subcategory, _ in views
+    ], dtype=float)
+
+    event_users = np.array([row[0] for row in chats] + [row[0] for row in views], dtype=np.int64)
+    event_columns = np.concatenate([chat_columns, view_columns])
+    event_weights = np.concatenate([
+        CHAT_WEIGHT * _decay(_ages([row[2] for row in chats], cutoff)),
+        VIEW_WEIGHT * _decay(_ages([row[3] for row in views], cutoff)),
+    ])
+    # Uncategorised events (None becomes NaN) add nothing
+    known = ~np.isnan(event_columns)
+    event_users, event_columns, event_weights = event_users[known], event_columns[known].astype(np.int64), event_weights[known]
+
+    study_users = np.array([row[0] for row in study], dtype=np.int64)
+    study_days = [study_reference(row[1]) for row in study]
+    study_weights = (
+        np.array([row[2] or 0 for row in study], dtype=float) / 60.0 * STUDY_MINUTE_WEIGHT
+        * _decay(_ages(study_days, cutoff))
+    )
+
+    user_ids, rows = np.unique(np.concatenate([event_users, study_users]), return_inverse=True)
+    activity = np.zeros((len(user_ids), len(CATEGORIES)))
+    np.add.at(activity, (rows[:len(event_users)], event_columns), event_weights)
+
+    # Study time isn't tagged with a subject, so it is shared out like the user's other activity
+    study_time = np.zeros(len(user_ids))
+    np.add.at(study_time, rows[len(event_users):], study_weights)
+    totals = activity.sum(axis=1, keepdims=True)
+    shares = np.divide(activity, totals, out=np.zeros_like(activity), where=totals > 0)
+    activity += shares * study_time[:, None]
+    return user_ids, activity
+
+class ScoreBoard:
+    """Decayed activity per user and category in growable arrays, safe to share between threads"""
+
+    def __init__(self, capacity: int = 1024):
+        self._rows: Dict[int, int] = {}
+        self._activity = np.zeros((capacity, len(CATEGORIES)))
+        self._updated = np.zeros(capacity)  # Unix time each row's activity was last decayed to
+        self._lock = threading.Lock()
+
+    def _row(self, user_id: int, now: float) -> int:
+        row = self._rows.get(user_id)
+        if row is None:
+            row = len(self._rows)
+            if row == len(self._activity):
+                self._activity = np.concatenate([self._activity, np.zeros_like(self._activity)])
+                self._updated = np.concatenate([self._updated, np.zeros_like(self._updated)])
+            self._rows[user_id] = row
+            self._updated[row] = now
+        return row
+
+    def _decay_to(self, row: int, now: float):
+        elapsed = now - self._updated[row]
+        if elapsed > 0:
+            self._activity[row] *= np.exp(-_DECAY_RATE * elapsed)
+            self._updated[row] = now
+
+    def add(self, user_id: int, column: int, amount: float, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._row(user_id, now)
+            self._decay_to(row, now)
+            self._activity[row, column] += amount
+
+    def add_shared(self, user_id: int, amount: float, now: Optional[float] = None):
+        """Spread activity over the categories in proportion to the user's current activity"""
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                return
+            self._decay_to(row, now)
+            total = self._activity[row].sum()
+            if total > 0:
+                self._activity[row] += amount * self._activity[row] / total
+
+    def activity(self, user_id: int, now: Optional[float] = None) -> np.ndarray:
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                return np.zeros(len(CATEGORIES))
+            return self._activity[row] * np.exp(-_DECAY_RATE * max(0.0, now - self._updated[row]))
+
+    def replace(self, user_ids: np.ndarray, activity: np.ndarray, as_of: float):
+        """Swap in a bulk result; every row is stamped as decayed to as_of"""
+        rows = {int(user_id): row for row, user_id in enumerate(user_ids)}
+        capacity = max(1024, len(rows) * 2)
+        new_activity = np.zeros((capacity, len(CATEGORIES)))
+        new_activity[:len(rows)] = activity
+        new_updated = np.zeros(capacity)
+        new_updated[:len(rows)] = as_of
+        with self._lock:
+            self._rows, self._activity, self._updated = rows, new_activity, new_updated
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+def _apply_to(board: ScoreBoard, kind: str, user_id: int, value: float, now: float):
+    """Apply one event; kind is a category column, or "shared" for study time"""
+    if kind == "shared":
+        board.add_shared(user_id, value, now)
+    else:
+        board.add(user_id, int(kind), value, now)
+
+class ScoringEngine:
+    """Applies activity to the score board as it happens and rebuilds it from history periodically"""
+
+    def __init__(self, recompute_interval: float = RECOMPUTE_INTERVAL):
+        self.recompute_interval = recompute_interval
+        self.board = ScoreBoard()
+        # Events seen while a rebuild is running, replayed onto its result if they are
+        # newer than its cutoff: (kind, user id, value, event time)
+        self._journal: Optional[List[Tuple[str, int, float, float]]] = None
+        self._cutoff = 0.0
+        self._journal_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.recomputes = 0
+        self.last_recompute_seconds = 0.0
+
+    def _apply(self, kind: str, user_id: int, value: float, now: float):
+        # Under the journal lock, so an event lands on exactly one board or in the replay
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.append((kind, user_id, value, now))
+            _apply_to(self.board, kind, user_id, value, now)
+
+    def record_chat(self, user_id: int, message: str, created_at: datetime):
+        """Count a stored chat message; created_at is its stored timestamp (naive UTC)"""
+        column = classify_text(message)
+        if column is not None:
+            self._apply(str(column), user_id, CHAT_WEIGHT, _timestamp(created_at))
+
+    def record_view(self, user_id: int, category: Optional[str], subcategory: Optional[str], viewed_at: datetime):
+        """Count a tutorial view; viewed_at is the time its history row is written with (naive UTC)"""
+        column = classify_subject(category, subcategory)
+        if column is not None:
+            self._apply(str(column), user_id, VIEW_WEIGHT, _timestamp(viewed_at))
+
+    def record_study_time(self, user_id: int, seconds: int, day: Optional[date] = None):
+        """Count seconds credited to a user's day, decayed from the day's start like the rebuild does"""
+        if seconds > 0:
+            now = time.time()
+            age = now - _timestamp(study_reference(day or datetime.utcnow().date()))
+            amount = seconds / 60.0 * STUDY_MINUTE_WEIGHT * float(_decay(np.array([age]))[0])
+            self._apply("shared", user_id, amount, now)
+
+    def scores(self, user_id: int) -> schemas.SubjectCategoryScore:
+        values = to_scores(self.board.activity(user_id))
+        return schemas.SubjectCategoryScore(**{
+            category: round(float(value), 1) for category, value in zip(CATEGORIES, values)
+        })
+
+    def _start_journal(self):
+        with self._journal_lock:
+            self._journal = []
+            self._cutoff = time.time()
+
+    def _compute(self, cutoff: float) -> Tuple[np.ndarray, np.ndarray]:
+        db = SessionLocal()
+        try:
+            return compute_all(db, datetime.utcfromtimestamp(cutoff))
+        finally:
+            db.close()
+
+    async def recompute(self) -> int:
+        """
+        Rebuild every user's row from the stored history; returns the number of users
+        Study time has no finer timestamp than its day, so the journal starts in the same
+        step as the study-time buffer is taken: everything credited before is in the
+        database, everything after is replayed. Chats and views are split by their own
+        timestamps, with buffered views written before the history is read.
+        """
+        started = time.perf_counter()
+        try:
+            async with study_time.buffer.paused(on_take=self._start_journal):
+                async with tutorial_views.buffer.paused():
+                    cutoff = self._cutoff
+                    user_ids, activity = await run_in_threadpool(self._compute, cutoff)
+        except BaseException:
+            with self._journal_lock:
+                self._journal = None
+            raise
+
+        board = ScoreBoard()
+        board.replace(user_ids, activity, cutoff)
+        with self._journal_lock:
+            # Replay what happened after the cutoff, then make the new board live
+            for kind, user_id, value, at in self._journal:
+                if at >= cutoff:
+                    _apply_to(board, kind, user_id, value, at)
+            self._journal = None
+            self.board = board
+        self.recomputes += 1
+        self.last_recompute_seconds = time.perf_counter() - started
+        return len(user_ids)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.recompute()
+            except Exception as e:
+                print(f"Warning: Failed to recompute scores: {e}")
+            await asyncio.sleep(self.recompute_interval)
+
+    def start(self):
+        """Build the scores from history now, then again every recompute_interval"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.board),
+            "recomputes": self.recomputes,
+            "last_recompute_ms": round(self.last_recompute_seconds * 1000, 1),
+        }
+
+# Shared by the activity hooks, the scores endpoint and the app's startup and shutdown
+engine = ScoringEngine()
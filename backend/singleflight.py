@@ -0,0 +1,35 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller starts the work,
+    later callers await the same in-flight task instead of starting their own
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    def start(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Start func for key unless it is already running, and return the task"""
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func for key, or wait for the call already in flight"""
+        # Shield so one caller disconnecting doesn't cancel the work for everyone else
+        return await asyncio.shield(self.start(key, func))
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Background calls may have no awaiter; log their failures instead of losing them
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Warning: Call for {key!r} failed: {task.exception()}")
@@ -0,0 +1,188 @@
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from database import write_in_session
+from ttl_cache import TTLCache
+from write_behind import WriteBehindBuffer
+import models
+import schemas
+
+# Most seconds credited for one heartbeat; beyond that a heartbeat is also capped at the time
+# since the user's previous one, so replayed or rapid-fire heartbeats can't inflate the total
+MAX_HEARTBEAT_SECONDS = int(os.getenv("STUDY_HEARTBEAT_MAX_SECONDS", "120"))
+
+# How often buffered study time is written; at most this much is lost if the process dies
+FLUSH_INTERVAL = float(os.getenv("STUDY_TIME_FLUSH_INTERVAL", "15"))
+
+SECONDS_PER_DAY = 24 * 3600
+
+# Seconds by day, per user
+PendingTotals = Dict[int, Dict[date, int]]
+
+# Folds duplicate (user, day) rows left by older versions into the oldest one,
+# so the unique index the upserts rely on can be built
+_MERGE_DUPLICATE_DAYS = (
+    """
+    UPDATE time_spent_records SET total_seconds = (
+        SELECT SUM(COALESCE(t.total_seconds, 0)) FROM time_spent_records t
+        WHERE t.user_id = time_spent_records.user_id AND t.date = time_spent_records.date
+    )
+    WHERE id IN (
+        SELECT MIN(id) FROM time_spent_records GROUP BY user_id, date HAVING COUNT(*) > 1
+    )
+    """,
+    """
+    DELETE FROM time_spent_records
+    WHERE id NOT IN (SELECT MIN(id) FROM time_spent_records GROUP BY user_id, date)
+    """,
+)
+
+def ensure_schema(engine):
+    """
+    Add the rollup indexes to tables created by older versions, merging duplicate days first
+    Raises if they can't be built: without the unique index every flush would fail
+    """
+    with engine.begin() as connection:
+        merged, removed = (connection.execute(text(statement)).rowcount for statement in _MERGE_DUPLICATE_DAYS)
+    if removed > 0:
+        print(f"Warning: Merged {removed} duplicate daily study-time rows into {merged} days")
+    for index in models.TimeSpentRecord.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+def upsert_daily_totals(db: Session, totals: PendingTotals) -> int:
+    """Add buffered seconds to each user's daily rollup in one batched upsert"""
+    rows = [
+        {"user_id": user_id, "date": day, "total_seconds": seconds}
+        for user_id, days in totals.items()
+        for day, seconds in days.items()
+        if seconds > 0
+    ]
+    if not rows:
+        return 0
+    statement = insert(models.TimeSpentRecord)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[models.TimeSpentRecord.user_id, models.TimeSpentRecord.date],
+            set_={
+                "total_seconds": models.TimeSpentRecord.total_seconds + statement.excluded.total_seconds
+            }
+        ),
+        rows
+    )
+    db.commit()
+    return len(rows)
+
+class StudyTimeBuffer(WriteBehindBuffer):
+    """
+    Study time accumulated in memory per (user, day) and written in batches
+    A heartbeat is a dictionary update; the database sees one upsert per active
+    user per flush interval, however often the clients report
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__("study time", flush_interval)
+        self._pending: PendingTotals = {}
+        # Taken by a flush that hasn't committed yet; still counted in reports
+        self._in_flight: PendingTotals = {}
+        # When each user last sent a heartbeat; older ones can't limit a heartbeat below the cap
+        self._last_seen = TTLCache(maxsize=100000, ttl=MAX_HEARTBEAT_SECONDS)
+        self.counts["heartbeats"] = 0
+
+    def add(self, user_id: int, seconds: int, day: Optional[date] = None) -> int:
+        """
+        Credit seconds of study to a user's day; returns the seconds credited
+        A heartbeat never credits more than the time since the user's previous one
+        """
+        day = day or datetime.utcnow().date()
+        now = time.monotonic()
+        with self._lock:
+            self.counts["heartbeats"] += 1
+            last_seen = self._last_seen.get(user_id)
+            self._last_seen.set(user_id, now)
+            limit = MAX_HEARTBEAT_SECONDS if last_seen is None else min(MAX_HEARTBEAT_SECONDS, round(now - last_seen))
+            seconds = max(0, min(int(seconds), limit))
+            if seconds:
+                days = self._pending.setdefault(user_id, {})
+                days[day] = days.get(day, 0) + seconds
+        return seconds
+
+    def pending_for(self, user_id: int, start: date, end: date) -> Dict[date, int]:
+        """Seconds not yet in the database for a user's days between start and end"""
+        totals: Dict[date, int] = {}
+        with self._lock:
+            for source in (self._in_flight, self._pending):
+                for day, seconds in source.get(user_id, {}).items():
+                    if start <= day <= end:
+                        totals[day] = totals.get(day, 0) + seconds
+        return totals
+
+    def _take(self) -> PendingTotals:
+        self._in_flight, self._pending = self._pending, {}
+        return self._in_flight
+
+    def _restore(self, batch: PendingTotals):
+        for user_id, days in batch.items():
+            pending = self._pending.setdefault(user_id, {})
+            for day, seconds in days.items():
+                pending[day] = pending.get(day, 0) + seconds
+
+    def _finish(self, batch: PendingTotals):
+        self._in_flight = {}
+
+    async def _write(self, batch: PendingTotals) -> int:
+        return await write_in_session(upsert_daily_totals, batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_users": len(self._pending),
+                "pending_seconds": sum(sum(days.values()) for days in self._pending.values()),
+                **self.counts,
+            }
+
+def week_start(day: date) -> date:
+    """The Monday of the week containing day"""
+    return day - timedelta(days=day.weekday())
+
+def get_weekly_report(db: Session, user_id: int, start: date, pending: Dict[date, int]) -> schemas.WeeklyTimeReport:
+    """Seven days of study time from start, read from the daily rollups plus unflushed seconds"""
+    end = start + timedelta(days=6)
+    # Reads only columns in the covering index (id is the rowid), so no table lookups
+    stored = {
+        day: (record_id, seconds)
+        for record_id, day, seconds in db.query(
+            models.TimeSpentRecord.id,
+            models.TimeSpentRecord.date,
+            models.TimeSpentRecord.total_seconds
+        ).filter(
+            models.TimeSpentRecord.user_id == user_id,
+            models.TimeSpentRecord.date.between(start, end)
+        )
+    }
+    db.rollback()
+
+    days = []
+    for offset in range(7):
+        day = start + timedelta(days=offset)
+        record_id, seconds = stored.get(day, (None, 0))
+        total = min(SECONDS_PER_DAY, (seconds or 0) + pending.get(day, 0))
+        days.append(schemas.TimeSpentRecord(
+            id=record_id,
+            user_id=user_id,
+            date=day,
+            total_seconds=total,
+            hours=total // 3600,
+            minutes=total % 3600 // 60,
+            seconds=total % 60
+        ))
+    return schemas.WeeklyTimeReport(
+        days=days,
+        total_hours=round(sum(d.total_seconds for d in days) / 3600, 2)
+    )
+
+# Shared by the heartbeat endpoint and the app's startup and shutdown
+buffer = StudyTimeBuffer()
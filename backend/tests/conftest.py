@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+# Configure the app before it is imported: a throwaway database, the local stub model and
+# no per-user rate limit
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("STUB_LATENCY_MS", "1")
+os.environ.setdefault("STUB_TOKENS_PER_SECOND", "0")
+os.environ.setdefault("PBKDF2_ITERATIONS", "1000")
+os.environ.setdefault("ADMISSION_USER_RATE", "0")
+os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+    with TestClient(main.app) as c:
+        yield c
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    client.post("/signup", json={"username": "tester", "email": "tester@example.com", "password": "secret"})
+    token = client.post("/login", data={"username": "tester", "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,28 @@
+import asyncio
+import chatbot
+from routes import cache
+
+class CountingProvider(chatbot.llm.StubProvider):
+    def __init__(self):
+        super().__init__(latency=0)
+        self.calls = 0
+
+    async def generate(self, prompt):
+        self.calls += 1
+        return f"answer {self.calls}"
+
+def test_refresh_bypasses_chat_caches(monkeypatch):
+    original = chatbot.provider
+    provider = CountingProvider()
+    chatbot.set_provider(provider)
+    monkeypatch.setattr(cache, "write_in_session", lambda *args: asyncio.sleep(0))
+    try:
+        first = asyncio.run(cache.generate_explanation("Fractions"))
+        assert asyncio.run(cache.generate_explanation("Fractions")) == first
+        calls = provider.calls
+        refreshed = asyncio.run(cache.generate_explanation("Fractions", refresh=True))
+    finally:
+        chatbot.set_provider(original)
+    assert refreshed != first
+    # Every stage called the model again instead of reusing its cached output
+    assert provider.calls == 2 * calls
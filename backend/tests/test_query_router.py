@@ -0,0 +1,18 @@
+import metrics
+from query_router import DIRECT, QueryRouter, classify
+
+def test_decision_is_added_to_the_request_trace():
+    trace = metrics.Trace("abc", "POST", "/chat")
+    token = metrics._current_trace.set(trace)
+    try:
+        router = QueryRouter()
+        router.record(classify("thanks!"), {})
+    finally:
+        metrics._current_trace.reset(token)
+    attributes = trace.to_dict(0.1)["attributes"]
+    assert attributes == {"route": DIRECT, "reason": "small_talk", "saved_ms": None}
+
+def test_record_without_a_trace():
+    router = QueryRouter()
+    router.record(classify("what is a prime number"), {})
+    assert router.counts[DIRECT] == 1
@@ -0,0 +1,34 @@
+import asyncio
+import pytest
+import chatbot
+import llm
+import resilience
+from resilience import ModelCaller, ModelUnavailable
+
+# Matched by name like the google.api_core exception, without needing the Gemini SDK
+ServiceUnavailable = type("ServiceUnavailable", (Exception,), {})
+
+class UnavailableProvider(llm.StubProvider):
+    async def generate(self, prompt):
+        raise ServiceUnavailable("upstream overloaded")
+
+@pytest.fixture
+def unavailable_provider(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    original = chatbot.provider
+    chatbot.set_provider(UnavailableProvider(latency=0))
+    yield
+    chatbot.set_provider(original)
+
+def test_transient_error_raised_as_model_unavailable_after_retries(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    caller = ModelCaller(max_retries=2)
+    with pytest.raises(ModelUnavailable) as raised:
+        asyncio.run(caller.generate(UnavailableProvider(latency=0), "prompt", "final"))
+    assert isinstance(raised.value.__cause__, ServiceUnavailable)
+    assert caller.counts["retries"] == 2
+
+def test_chat_returns_503_with_retry_after_for_transient_sdk_error(client, auth_headers, unavailable_provider):
+    response = client.post("/chat", data={"message": "tell me about fractions"}, headers=auth_headers)
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
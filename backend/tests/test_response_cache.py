@@ -0,0 +1,15 @@
+from response_cache import ResponseCache
+
+def test_disabled_cache_does_not_index():
+    cache = ResponseCache(maxsize=0)
+    for i in range(50):
+        cache.set(f"what is the derivative of x^{i}", "default", "answer")
+    assert cache.get("what is the derivative of x^1", "default") is None
+    assert cache._features == {}
+    assert cache._index == {}
+
+def test_similar_query_hits():
+    cache = ResponseCache(maxsize=16)
+    cache.set("What is the derivative of x squared?", "default", "2x")
+    assert cache.get("what is the derivative of x squared", "default") == "2x"
+    assert cache.get("what is the derivative of x squared", "other") is None
@@ -0,0 +1,172 @@
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.orm import Session
+from database import write_in_session, AsyncDB
+from ttl_cache import TTLCache
+from write_behind import WriteBehindBuffer
+import models
+import schemas
+
+# How often buffered views are written; at most this much is lost if the process dies
+FLUSH_INTERVAL = float(os.getenv("TUTORIAL_VIEWS_FLUSH_INTERVAL", "5"))
+
+# Buffered views that trigger a flush before the interval is up
+FLUSH_THRESHOLD = int(os.getenv("TUTORIAL_VIEWS_FLUSH_THRESHOLD", "1000"))
+
+# Recently viewed tutorials kept per user, and users kept in memory
+RECENT_PER_USER = int(os.getenv("RECENT_TUTORIALS_PER_USER", "20"))
+RECENT_USERS = int(os.getenv("RECENT_TUTORIALS_USERS", "10000"))
+
+class View:
+    __slots__ = ("user_id", "tutorial_id", "title", "viewed_at")
+
+    def __init__(self, user_id: int, tutorial_id: int, title: str, viewed_at: datetime):
+        self.user_id = user_id
+        self.tutorial_id = tutorial_id
+        self.title = title
+        self.viewed_at = viewed_at
+
+class RecentViews:
+    """A user's most recently viewed tutorials, newest view of each"""
+
+    def __init__(self):
+        self.items: Dict[int, Tuple[str, datetime]] = {}  # tutorial id -> (title, viewed_at)
+        # Whether the views stored before this process started have been merged in
+        self.loaded = False
+
+    def merge(self, tutorial_id: int, title: str, viewed_at: datetime):
+        current = self.items.get(tutorial_id)
+        if current is not None and current[1] >= viewed_at:
+            return
+        self.items[tutorial_id] = (title, viewed_at)
+        if len(self.items) > RECENT_PER_USER:
+            oldest = min(self.items, key=lambda key: self.items[key][1])
+            del self.items[oldest]
+
+    def newest(self, limit: int) -> List[schemas.RecentTutorial]:
+        ordered = sorted(self.items.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [
+            schemas.RecentTutorial(tutorial_id=tutorial_id, title=title, viewed_at=viewed_at)
+            for tutorial_id, (title, viewed_at) in ordered
+        ]
+
+def ensure_schema(engine):
+    """
+    Add the history index to tables created by older versions
+    Raises if it can't be built, like the other schema upgrades, rather than starting without it
+    """
+    for index in models.UserTutorialHistory.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+def write_views(db: Session, views: List[View]) -> int:
+    """Insert view history rows in bulk and move each tutorial's last_viewed_at forward once"""
+    db.execute(insert(models.UserTutorialHistory), [
+        {"user_id": view.user_id, "tutorial_id": view.tutorial_id, "viewed_at": view.viewed_at}
+        for view in views
+    ])
+    last_viewed: Dict[int, datetime] = {}
+    for view in views:
+        if view.viewed_at > last_viewed.get(view.tutorial_id, datetime.min):
+            last_viewed[view.tutorial_id] = view.viewed_at
+    viewed = bindparam("viewed_at", type_=models.Tutorial.last_viewed_at.type)
+    # Never move it backwards, e.g. when a failed batch is retried after a newer one;
+    # run on the connection, as an executemany UPDATE with a WHERE clause is plain Core
+    db.connection().execute(
+        update(models.Tutorial)
+        .where(models.Tutorial.id == bindparam("tutorial_id"))
+        .values(last_viewed_at=func.max(func.coalesce(models.Tutorial.last_viewed_at, viewed), viewed)),
+        [{"tutorial_id": tutorial_id, "viewed_at": viewed_at} for tutorial_id, viewed_at in last_viewed.items()]
+    )
+    db.commit()
+    return len(views)
+
+def load_recent(db: Session, user_id: int, limit: int = RECENT_PER_USER) -> List[Tuple[int, str, datetime]]:
+    """A user's most recently viewed tutorials from the stored history"""
+    rows = db.query(
+        models.UserTutorialHistory.tutorial_id,
+        models.Tutorial.title,
+        func.max(models.UserTutorialHistory.viewed_at)
+    ).join(
+        models.Tutorial, models.Tutorial.id == models.UserTutorialHistory.tutorial_id
+    ).filter(
+        models.UserTutorialHistory.user_id == user_id
+    ).group_by(
+        models.UserTutorialHistory.tutorial_id, models.Tutorial.title
+    ).order_by(
+        func.max(models.UserTutorialHistory.viewed_at).desc()
+    ).limit(limit).all()
+    db.rollback()
+    return [tuple(row) for row in rows]
+
+class TutorialViewBuffer(WriteBehindBuffer):
+    """
+    Tutorial views recorded in memory and written behind in batches
+    A view updates the viewer's recently-viewed list at once; the history rows and
+    last_viewed_at updates reach the database with the next flush
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__("tutorial views", flush_interval)
+        self._pending: List[View] = []
+        self._in_flight: List[View] = []
+        self._recent = TTLCache(maxsize=RECENT_USERS)
+        self.counts["views"] = 0
+
+    def record(self, user_id: int, tutorial_id: int, title: str, viewed_at: Optional[datetime] = None) -> datetime:
+        """Buffer a view and add it to the user's recently viewed list; returns the view time"""
+        view = View(user_id, tutorial_id, title, viewed_at or datetime.utcnow())
+        with self._lock:
+            self.counts["views"] += 1
+            self._pending.append(view)
+            recent = self._recent.get(user_id)
+            if recent is None:
+                recent = RecentViews()
+                self._recent.set(user_id, recent)
+            recent.merge(tutorial_id, title, view.viewed_at)
+            backlog = len(self._pending)
+        if backlog >= FLUSH_THRESHOLD:
+            self.request_flush()
+        return view.viewed_at
+
+    async def recently_viewed(self, db: AsyncDB, user_id: int, limit: int = RECENT_PER_USER) -> List[schemas.RecentTutorial]:
+        """A user's recently viewed tutorials, newest first; reads the database once per user"""
+        with self._lock:
+            recent = self._recent.get(user_id)
+            if recent is not None and recent.loaded:
+                return recent.newest(limit)
+        stored = await db.run(load_recent, user_id)
+        with self._lock:
+            recent = self._recent.get(user_id)
+            if recent is None:
+                recent = RecentViews()
+                self._recent.set(user_id, recent)
+            # Views recorded while this user was out of memory are still only in the buffer
+            for view in self._in_flight + self._pending:
+                if view.user_id == user_id:
+                    recent.merge(view.tutorial_id, view.title, view.viewed_at)
+            for tutorial_id, title, viewed_at in stored:
+                recent.merge(tutorial_id, title, viewed_at)
+            recent.loaded = True
+            return recent.newest(limit)
+
+    def _take(self) -> List[View]:
+        self._in_flight, self._pending = self._pending, []
+        return self._in_flight
+
+    def _restore(self, batch: List[View]):
+        self._pending = batch + self._pending
+
+    def _finish(self, batch: List[View]):
+        self._in_flight = []
+
+    async def _write(self, batch: List[View]) -> int:
+        return await write_in_session(write_views, batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending_views": len(self._pending), "recent_users": len(self._recent), **self.counts}
+
+# Shared by the tutorial endpoints and the app's startup and shutdown
+buffer = TutorialViewBuffer()
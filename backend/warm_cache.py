@@ -0,0 +1,143 @@
+"""
+Pre-generate explanations for every subcategory in subjects.json
+
+Runs each subcategory through the regular chat pipeline and writes the result
+into the explanation cache. Progress is checkpointed after every topic, so an
+interrupted run picks up where it stopped; the checkpoint is removed once a run
+completes without failures.
+
+    python warm_cache.py --concurrency 4 --rate 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List
+from database import SessionLocal
+from routes import cache
+from routes.subjects import catalog
+import explanation_store
+
+CHECKPOINT_FILE = "warm_cache_checkpoint.json"
+
+class RateLimiter:
+    """Spaces out calls to at most `rate` per minute"""
+
+    def __init__(self, rate: float):
+        self.interval = 60.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+def load_checkpoint(path: str, refresh: bool) -> Dict[str, Any]:
+    """The checkpoint of an interrupted run in the same mode, or a fresh one"""
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+        # A --refresh run can't resume from a normal run's progress, or the other way round
+        if checkpoint.get("refresh", False) == refresh:
+            return checkpoint
+        print(f"Ignoring checkpoint from a run {'with' if checkpoint.get('refresh') else 'without'} --refresh")
+    return {"refresh": refresh, "done": [], "failed": []}
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]):
+    # Write then rename, so a crash never leaves a truncated checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def pending_subcategories(checkpoint: Dict[str, Any]) -> List[str]:
+    """Subcategories still to generate, skipping completed and (unless refreshing) already cached ones"""
+    done = set(checkpoint["done"])
+    subcategories = [s for s in catalog.all_subcategories() if s not in done]
+    if checkpoint["refresh"]:
+        return subcategories
+    db = SessionLocal()
+    try:
+        # Read without touching last_accessed_at, so warming doesn't defeat LRU eviction
+        cached = explanation_store.cached_subcategories(db)
+    finally:
+        db.close()
+    return [s for s in subcategories if s not in cached]
+
+async def warm(
+    subcategories: List[str],
+    concurrency: int,
+    rate: float,
+    retries: int,
+    checkpoint: Dict[str, Any],
+    checkpoint_path: str
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    total = len(subcategories)
+    completed = 0
+    start = time.perf_counter()
+
+    async def one(subcategory: str):
+        nonlocal completed
+        async with semaphore:
+            for attempt in range(retries + 1):
+                await limiter.wait()
+                topic_start = time.perf_counter()
+                try:
+                    await cache.generate_explanation(subcategory, refresh=checkpoint["refresh"])
+                    break
+                except Exception as e:
+                    print(f"  {subcategory}: attempt {attempt + 1} failed: {e}")
+                    if attempt < retries:
+                        await asyncio.sleep(2 ** attempt)
+            else:
+                if subcategory not in checkpoint["failed"]:
+                    checkpoint["failed"].append(subcategory)
+                save_checkpoint(checkpoint_path, checkpoint)
+                return
+
+            completed += 1
+            checkpoint["done"].append(subcategory)
+            if subcategory in checkpoint["failed"]:
+                checkpoint["failed"].remove(subcategory)
+            save_checkpoint(checkpoint_path, checkpoint)
+            elapsed = time.perf_counter() - start
+            print(f"[{completed}/{total}] {subcategory} "
+                  f"({time.perf_counter() - topic_start:.1f}s, {completed / elapsed * 60:.1f} topics/min)")
+
+    await asyncio.gather(*(one(s) for s in subcategories))
+    elapsed = time.perf_counter() - start
+    print(f"Generated {completed}/{total} explanations in {elapsed:.1f}s"
+          + (f" ({completed / elapsed * 60:.1f} topics/min)" if elapsed else ""))
+    if checkpoint["failed"]:
+        print(f"Failed: {', '.join(checkpoint['failed'])}")
+    elif completed == total and os.path.exists(checkpoint_path):
+        # Finished cleanly, so the next run starts over rather than resuming
+        os.remove(checkpoint_path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4, help="topics generated at once")
+    parser.add_argument("--rate", type=float, default=30, help="max generations started per minute (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2, help="retries per topic")
+    parser.add_argument("--refresh", action="store_true", help="regenerate topics that are already cached")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="checkpoint file used to resume")
+    parser.add_argument("--restart", action="store_true", help="ignore the existing checkpoint")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    checkpoint = load_checkpoint(args.checkpoint, args.refresh)
+    subcategories = pending_subcategories(checkpoint)
+    print(f"{len(subcategories)} subcategories to generate")
+    asyncio.run(warm(subcategories, args.concurrency, args.rate, args.retries, checkpoint, args.checkpoint))
+
+if __name__ == "__main__":
+    main()
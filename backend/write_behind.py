@@ -0,0 +1,127 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+class WriteBehindBuffer:
+    """
+    Writes collected in memory and applied in batches by a background task
+    Subclasses hold the buffered state and implement _take, _restore and _write;
+    _take and _restore run under self._lock, so recording stays a cheap in-memory update
+    """
+
+    def __init__(self, name: str, flush_interval: float):
+        self.name = name
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counts: Dict[str, int] = {"flushes": 0, "rows_written": 0, "failed_flushes": 0}
+
+    def _take(self) -> Any:
+        """Detach and return everything buffered, or None if there is nothing to write"""
+        raise NotImplementedError
+
+    def _restore(self, batch: Any):
+        """Put back a batch whose write failed, so the next flush retries it"""
+        raise NotImplementedError
+
+    def _finish(self, batch: Any):
+        """Called once a batch has been written or restored"""
+
+    async def _write(self, batch: Any) -> int:
+        """Write a batch and return the rows written"""
+        raise NotImplementedError
+
+    async def flush(self) -> int:
+        """Write everything buffered so far; on failure it is kept for the next flush"""
+        with self._lock:
+            if self._flushing:
+                return 0
+            batch = self._take()
+            if not batch:
+                return 0
+            self._flushing = True
+        try:
+            return await self._write_batch(batch) or 0
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    async def _write_batch(self, batch: Any) -> Optional[int]:
+        """Write a taken batch, restoring it on failure; returns the rows written, or None if it failed"""
+        rows = None
+        try:
+            rows = await self._write(batch)
+        except Exception as e:
+            print(f"Warning: Failed to flush {self.name}: {e}")
+            with self._lock:
+                self.counts["failed_flushes"] += 1
+                self._restore(batch)
+        else:
+            self.counts["flushes"] += 1
+            self.counts["rows_written"] += rows
+        finally:
+            with self._lock:
+                self._finish(batch)
+        return rows
+
+    @asynccontextmanager
+    async def paused(self, on_take: Optional[Callable[[], None]] = None) -> AsyncIterator[None]:
+        """
+        Write everything buffered so far, then hold further flushes until the block exits,
+        so the database holds exactly what was recorded before the batch was taken
+        on_take runs in the same event loop step as the take, before anything else is recorded
+        Raises if the write fails
+        """
+        while True:
+            with self._lock:
+                if not self._flushing:
+                    self._flushing = True
+                    batch = self._take()
+                    break
+            # A flush is running; wait for it to commit
+            await asyncio.sleep(0.01)
+        try:
+            if on_take is not None:
+                on_take()
+            if batch and await self._write_batch(batch) is None:
+                raise RuntimeError(f"Failed to flush {self.name}")
+            yield
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def request_flush(self):
+        """Flush soon rather than at the next interval; safe to call from any thread"""
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        """Start flushing periodically on the running event loop"""
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._stop = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush, writing whatever is still buffered"""
+        if self._task is not None:
+            self._stop.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
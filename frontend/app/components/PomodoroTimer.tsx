@@ -1,9 +1,10 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Play, Pause, RotateCcw } from 'lucide-react';
 import { Button } from './ui/button';
 import { cn } from '../lib/utils';
+import { sendStudyHeartbeat } from '../services/api';
 import Image from 'next/image';
 import lemon1 from '../assets/images/lemon1.png';
 import lemon2 from '../assets/images/lemon2.png';
@@ -15,6 +16,9 @@ interface TimerOption {
   label: string;
 }
 
+// Focus time is reported in batches of this many seconds, and whenever the timer stops
+const HEARTBEAT_SECONDS = 30;
+
 const timerOptions: TimerOption[] = [
   {
     id: '25-5',
@@ -42,6 +46,17 @@ export default function PomodoroTimer() {
   const [isRunning, setIsRunning] = useState(false);
   const [isBreak, setIsBreak] = useState(false);
   const [showOptions, setShowOptions] = useState(false);
+  const unreportedSeconds = useRef(0);
+
+  const reportFocusTime = () => {
+    const seconds = unreportedSeconds.current;
+    if (seconds > 0) {
+      unreportedSeconds.current = 0;
+      sendStudyHeartbeat(seconds).catch(() => {
+        unreportedSeconds.current += seconds;
+      });
+    }
+  };
 
   useEffect(() => {
     let interval: NodeJS.Timeout;
@@ -49,9 +64,16 @@ export default function PomodoroTimer() {
     if (isRunning && timeLeft > 0) {
       interval = setInterval(() => {
         setTimeLeft((prev) => prev - 1);
+        if (!isBreak) {
+          unreportedSeconds.current += 1;
+          if (unreportedSeconds.current >= HEARTBEAT_SECONDS) {
+            reportFocusTime();
+          }
+        }
       }, 1000);
     } else if (timeLeft === 0) {
       if (!isBreak) {
+        reportFocusTime();
         setTimeLeft(selectedOption.break * 60);
         setIsBreak(true);
       } else {
@@ -63,6 +85,15 @@ export default function PomodoroTimer() {
     return () => clearInterval(interval);
   }, [isRunning, timeLeft, isBreak, selectedOption]);
 
+  // Report the remainder when the timer is paused or the page is left
+  useEffect(() => {
+    if (!isRunning) {
+      reportFocusTime();
+    }
+  }, [isRunning]);
+
+  useEffect(() => reportFocusTime, []);
+
   const minutes = Math.floor(timeLeft / 60);
   const seconds = timeLeft % 60;
 
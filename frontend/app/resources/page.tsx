@@ -111,42 +111,15 @@ export default function ResourcesPage() {
 
       setIsLoading(true);
       try {
-        // First try to get from cache
-        const cacheResponse = await fetch(`http://localhost:8000/api/cache/explanation/${encodeURIComponent(selectedSubcategory)}`);
-        const cacheData = await cacheResponse.json();
+        // The server generates and caches the explanation on a miss
+        const response = await fetch(`http://localhost:8000/api/cache/explanation/${encodeURIComponent(selectedSubcategory)}`);
 
-        if (cacheData.explanation) {
-          setExplanation(cacheData.explanation);
-        } else {
-          // If not in cache, get from chat endpoint
-          const formData = new FormData();
-          formData.append('message', `I don't understand ${selectedSubcategory}. Can you explain it to me?`);
-
-          const chatResponse = await fetch('http://localhost:8000/chat', {
-            method: 'POST',
-            headers: {
-              'Authorization': `Bearer ${authToken}`,
-            },
-            body: formData,
-          });
-
-          if (!chatResponse.ok) {
-            throw new Error('Chat request failed');
-          }
-
-          const chatData = await chatResponse.json();
-
-          // Cache the response
-          await fetch(`http://localhost:8000/api/cache/explanation/${encodeURIComponent(selectedSubcategory)}`, {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ explanation: chatData.response }),
-          });
-
-          setExplanation(chatData.response);
+        if (!response.ok) {
+          throw new Error('Explanation request failed');
         }
+
+        const data = await response.json();
+        setExplanation(data.explanation ?? '');
       } catch (error) {
         console.error('Error fetching explanation:', error);
         setExplanation('Failed to load explanation. Please try again later.');
@@ -36,6 +36,11 @@ export const getLearningProfile = async (): Promise<LearningProfile> => {
   return response.data;
 };
 
+// Report focus time to the backend, which aggregates it into daily totals
+export const sendStudyHeartbeat = async (seconds: number): Promise<void> => {
+  await api.post('/api/study-time/heartbeat', { seconds });
+};
+
 export interface Message {
   content: string;
   role: string;